@@ -1,135 +1,35 @@
-import math
-from inspect import isfunction
-from functools import partial
-
-import matplotlib.pylab as plt
-from tqdm.auto import tqdm
-from einops import rearrange
+# DDIM sampling (Song et al., "Denoising Diffusion Implicit Models") with the Unet, schedules
+# and checkpoints from model.py; importing this module has no side effects
+import argparse
 
 import torch
-from torch import nn, einsum
-import torch.nn.functional as F
-
-import numpy as np
-from torchvision.transforms import Compose, ToTensor, Lambda, ToPILImage, CenterCrop, Resize
-
-
-
-def exists(x):
-     return x is not None
-
-def default(val, d):
-     if exists(val):
-          return val
-     return d() if isfunction(d) else d
-
-class Residual(nn.Module):
-     def __init__(self, fn):
-          super().__init__()
-          self.fn = fn
-     def forward(self, x, *args, **kwargs):
-          return self.fn(x, *args, **kwargs) + x
-
-def Upsample(dim):
-     return nn.ConvTranspose2d(dim, dim, 4, 2, 1)
-
-def Downsample(dim):
-     return nn.Conv2d(dim, dim, 4, 2, 1)
-
-
-
-# position embeddings
-class SinusoidalPositionEmbedding(nn.Module):
-     def __init__(self, dim):
-          super().__init__()
-          self.dim = dim
-     def forward(self, time):
-          device = time.device
-          half_dim = self.dim // 2
-          embeddings = math.log(10000) / (half_dim - 1)
-          embeddings = torch.exp(torch.arrange(half_dim, device = device) * -embeddings)
-          embeddings = time[:, None] * embeddings[None, :]
-          embeddings = torch.cat((embeddings.sin(), embeddings.cos()), dim = -1)
-          return embeddings
-
-
-# ResNet block
-class Block(nn.Module):
-     def __init__(self, dim, dim_out, groups = 8):
-          super().__init__()
-          self.proj = nn.Conv2d(dim, dim_out, 3, padding = 1)
-          self.norm = nn.GroupNorm(groups, dim_out)
-          self.act = nn.SiLU()
-
-     def forward(self, x, scale_shift = None):
-          x = self.proj(x)
-          x = self.norm(x)
-
-          if exists(scale_shift):
-               scale, shift = scale_shift
-               x = x * (scale + 1) + shift
-          
-          x = self.act(x)
-          return x
-
-class ResnetBlock(nn.Module):
-     def __init__(self, dim, dim_out, *, time_emb_dim = None, groups = 8):
-          super().__init__()
-          self.mlp = (
-               nn.Sequential(nn.SiLU(), nn.Linear(time_emb_dim, dim_out))
-               if exists(time_emb_dim)
-               else None
-          )
-
-          self.block1 = Block(dim, dim_out, groups=groups)
-          self.block2 = Block(dim_out, dim_out, groups=groups)
-          self.res_conv = nn.Conv2d(dim, dim_out, 1) if dim != dim_out else nn.Identity()
 
-     def forward(self, x, time_emb=None):
-          h = self.block1(x)
+from model import (
+    generate,
+    load_checkpoint,
+    load_decoder,
+    save_images,
+)
 
-          if exists(self.mlp) and exists(time_emb):
-               time_emb = self.mlp(time_emb)
-               h = rearrange(time_emb, "b c -> b c 1 1") + h
-          
-          h = self.block2(h)
-          return h + self.res_conv(x)
 
-class ConvNextBlock(nn.Module):
-     def __init__(self, dim, dim_out, *, time_emb_dim=None, mult=2, norm=True):
-          super().__init__()
-          self.mlp = (
-               nn.Sequential(nn.GELU(), nn.Linear(time_emb_dim, dim))
-               if exists(time_emb_dim)
-               else None
-          )
-          
-          self.ds_conv = nn.Conv2d(dim, dim, 7, padding=3, groups=dim)
-          self.net = nn.Sequential(
-               nn.GroupNorm(1,dim) if norm else nn.Identity(),
-               nn.Conv2d(dim, dim_out * mult, 3, padding=1),
-               nn.GELU(),
-               nn.GroupNorm(1, dim_out * mult),
-               nn.Conv2d(dim_out * mult, dim_out, 3, padding=1),
-          )
+def main():
+    parser = argparse.ArgumentParser(description="Sample a trained Unet with DDIM.")
+    parser.add_argument("--checkpoint", default="results/model.pt")
+    parser.add_argument("--n", type=int, default=64)
+    parser.add_argument("--steps", type=int, default=50)
+    parser.add_argument("--eta", type=float, default=0.0, help="0 is deterministic DDIM, 1 matches DDPM noise")
+    parser.add_argument("--output", default="results/ddim_samples.png")
+    parser.add_argument("--animation", default="", help="optional GIF/video of the trajectory")
+    args = parser.parse_args()
 
-          self.res_conv = nn.Conv2d(dim, dim_out, 1) if dim != dim_out else nn.Identity()
-     
-     def forward(self, x, time_emb=None):
-          h = self.ds_conv(x)
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    model, config = load_checkpoint(args.checkpoint, device=device)
+    decoder, scale_factor = load_decoder(config, device=device)
 
-          if exists(self.mlp) and exists(time_emb):
-               assert exists(time_emb), "time embedding must be passed in"
-               condition = self.mlp(time_emb)
-               h = h +rearrange(condition, "b c -> b c 1 1")
+    images = generate(model, config, decoder, scale_factor, n=args.n, sampler="ddim", animation=args.animation,
+                      stride=1, ddim_steps=args.steps, eta=args.eta)
+    save_images(images, args.output)
 
-          h = self.net(h)
-          return h + self.res_conv(x)
 
-# attention
-class Attention(nn.Module):
-     def __init__(self, dim, heads=4, dim_head=32):
-          super().__init__()
-          self.scale = dim_head ** -0.5
-          self.heads = heads
-          hidden_dim = dim_head *
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+import io
+import os
+import json
+import time
+import base64
+import asyncio
+import argparse
+
+from PIL import Image, ImageOps
+
+from gpt import QWEN_URL, QWEN_MODEL
+from llm_cache import LLMCache
+from llm_client import AsyncLLMClient, add_rate_arguments, rate_options
+from response_parser import followup_task, json_object_complete, parse_response
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp', '.bmp')
+
+
+def list_images(image_dir):
+    # relative paths, so result keys match the image names split_result.py expects
+    images = []
+    for dirpath, dirnames, filenames in os.walk(image_dir):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if filename.lower().endswith(IMAGE_EXTENSIONS):
+                images.append(os.path.relpath(os.path.join(dirpath, filename), image_dir))
+    return images
+
+
+def compact_jpeg(image_path, max_side=1024, max_bytes=400_000, quality=90, min_quality=60):
+    """Re-encode an image as a JPEG of at most `max_side` pixels and (if possible) `max_bytes`.
+
+    The quality is lowered first, then the image is shrunk further, so request
+    bodies stay small whatever the source format and resolution.
+    """
+    with Image.open(image_path) as img:
+        img = ImageOps.exif_transpose(img).convert("RGB")
+    img.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+
+    while True:
+        for q in range(quality, min_quality - 1, -10):
+            buffer = io.BytesIO()
+            img.save(buffer, format="JPEG", quality=q, optimize=True)
+            if buffer.tell() <= max_bytes:
+                return buffer.getvalue()
+        if max(img.size) <= 256:
+            return buffer.getvalue()
+        img = img.resize((int(img.width * 0.8), int(img.height * 0.8)), Image.Resampling.LANCZOS)
+
+
+def build_messages(task, image_b64):
+    return [{
+        "role": "user",
+        "content": [
+            {"image": image_b64},
+            {"text": task},
+        ]
+    }]
+
+
+def completed_images(output_path):
+    """Images that already have a successful line in the output JSONL (a torn last line is ignored)."""
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if record.get("error") is None:
+                done.add(record["image"])
+    return done
+
+
+class Annotator:
+    """Sends every image with the prompt.json task and streams the answers to a JSONL file.
+
+    Images are read and re-encoded in worker threads while `concurrency`
+    requests are in flight; each answer is appended (and flushed) as soon as it
+    arrives, so an interrupted run resumes with the images that have no
+    successful line yet.
+
+    Every identity group of an answer is validated separately. Groups that are
+    missing or invalid are asked for again in up to `followups` small requests
+    covering just those groups, instead of repeating the whole task.
+    """
+
+    def __init__(self, client, task, image_dir, output_path, max_side=1024, max_bytes=400_000, followups=2,
+                 stream=False):
+        self.client = client
+        self.task = task
+        self.image_dir = image_dir
+        self.output_path = output_path
+        self.max_side = max_side
+        self.max_bytes = max_bytes
+        self.followups = followups
+        # streamed answers are cut off as soon as the JSON object is closed
+        self.query_options = {"stream": True, "stop_when": json_object_complete} if stream else {}
+
+        self.done = 0
+        self.failed = 0
+        self.followup_requests = 0
+        self.request_bytes = 0
+
+    def encode(self, image):
+        data = compact_jpeg(os.path.join(self.image_dir, image), self.max_side, self.max_bytes)
+        return base64.b64encode(data).decode('utf-8')
+
+    async def annotate(self, image):
+        image_b64 = await asyncio.to_thread(self.encode, image)
+        self.request_bytes += len(image_b64)
+        start = time.perf_counter()
+        role, content = await self.client.query(build_messages(self.task, image_b64), **self.query_options)
+        result, problems = parse_response(content)
+
+        followups = 0
+        while problems and followups < self.followups:
+            followups += 1
+            self.followup_requests += 1
+            role, followup = await self.client.query(build_messages(followup_task(list(problems)), image_b64),
+                                                     max_tokens=100 * len(problems) + 100, **self.query_options)
+            fixed, problems = parse_response(followup, list(problems))
+            result.update(fixed)
+
+        return {
+            "image": image,
+            "model": self.client.model,
+            "response": content,
+            "result": result,
+            "invalid": problems,
+            "followups": followups,
+            "seconds": round(time.perf_counter() - start, 3),
+            "error": None,
+        }
+
+    async def worker(self, queue, output):
+        while True:
+            image = await queue.get()
+            if image is None:
+                return
+            try:
+                record = await self.annotate(image)
+                self.done += 1
+            except Exception as e:
+                record = {"image": image, "model": self.client.model, "error": repr(e)}
+                self.failed += 1
+            output.write(json.dumps(record, ensure_ascii=False) + "\n")
+            output.flush()
+
+    async def run(self, images):
+        # a bounded queue keeps only a few encoded images in memory however large the folder is
+        queue = asyncio.Queue(maxsize=self.client.max_in_flight * 2)
+        with open(self.output_path, 'a', encoding='utf-8') as output:
+            workers = [asyncio.create_task(self.worker(queue, output)) for _ in range(self.client.max_in_flight)]
+            for image in images:
+                await queue.put(image)
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Annotate an image folder with the prompt.json assessment task.")
+    parser.add_argument("image_dir")
+    parser.add_argument("--output", default="annotations.jsonl", help="JSONL results, appended to and resumed from")
+    parser.add_argument("--task", default="prompt.json", help="file holding the task text")
+    parser.add_argument("--url", default=QWEN_URL)
+    parser.add_argument("--model", default=QWEN_MODEL)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--max-side", type=int, default=1024, help="longest image side sent, in pixels")
+    parser.add_argument("--max-bytes", type=int, default=400_000, help="target JPEG size before base64")
+    parser.add_argument("--cache", default=None, help="SQLite response cache file")
+    parser.add_argument("--followups", type=int, default=2,
+                        help="follow-up requests for missing or invalid identity groups per image")
+    parser.add_argument("--stream", action="store_true",
+                        help="stream answers and stop reading once the JSON object is complete")
+    add_rate_arguments(parser)
+    args = parser.parse_args()
+
+    with open(args.task, 'r', encoding='utf-8') as f:
+        task = f.read().strip()
+    # prompt.json was pasted out of a Python string and still ends with its closing quotes
+    if task.endswith('"""'):
+        task = task[:-3].rstrip()
+
+    images = list_images(args.image_dir)
+    done = completed_images(args.output)
+    todo = [image for image in images if image not in done]
+    print(f"{len(images)} images, {len(done)} already annotated, {len(todo)} to go")
+
+    cache = LLMCache(args.cache) if args.cache else None
+
+    async def run():
+        async with AsyncLLMClient(url=args.url, model=args.model, concurrency=args.concurrency,
+                                  cache=cache, **rate_options(args)) as client:
+            annotator = Annotator(client, task, args.image_dir, args.output, args.max_side, args.max_bytes,
+                                  args.followups, args.stream)
+            start = time.perf_counter()
+            await annotator.run(todo)
+            elapsed = time.perf_counter() - start
+        print(f"{annotator.done} annotated, {annotator.failed} failed in {elapsed:.1f}s "
+              f"({annotator.followup_requests} follow-up requests), "
+              f"{annotator.request_bytes / max(annotator.done + annotator.failed, 1) / 1024:.0f} KiB/image sent")
+        print(json.dumps(client.metrics(), indent=2))
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
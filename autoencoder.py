@@ -0,0 +1,164 @@
+import json
+import argparse
+from pathlib import Path
+
+import numpy as np
+import torch
+from torch import nn
+import torch.nn.functional as F
+from torch.utils.data import DataLoader
+from tqdm.auto import tqdm
+
+
+# small convolutional autoencoder: 3x128x128 <-> 4x16x16
+class Autoencoder(nn.Module):
+    def __init__(self, channels=3, latent_channels=4, dim=64, dim_mults=(1, 2, 4)):
+        super().__init__()
+        self.channels = channels
+        self.latent_channels = latent_channels
+        self.downsample_factor = 2 ** len(dim_mults)
+
+        dims = [dim, *map(lambda m: dim * m, dim_mults)]
+        in_out = list(zip(dims[:-1], dims[1:]))
+
+        # every level halves the resolution
+        encoder = [nn.Conv2d(channels, dim, 3, padding=1)]
+        for dim_in, dim_out in in_out:
+            encoder += [
+                nn.Conv2d(dim_in, dim_out, 4, 2, 1),
+                nn.GroupNorm(8, dim_out),
+                nn.SiLU(),
+            ]
+        encoder.append(nn.Conv2d(dims[-1], latent_channels, 1))
+        self.encoder = nn.Sequential(*encoder)
+
+        decoder = [nn.Conv2d(latent_channels, dims[-1], 3, padding=1)]
+        for dim_in, dim_out in reversed(in_out):
+            decoder += [
+                nn.ConvTranspose2d(dim_out, dim_in, 4, 2, 1),
+                nn.GroupNorm(8, dim_in),
+                nn.SiLU(),
+            ]
+        decoder.append(nn.Conv2d(dim, channels, 3, padding=1))
+        self.decoder = nn.Sequential(*decoder)
+
+    def encode(self, x):
+        return self.encoder(x)
+
+    def decode(self, z):
+        return torch.tanh(self.decoder(z))
+
+    def forward(self, x):
+        return self.decode(self.encode(x))
+
+
+def train_autoencoder(autoencoder, dataloader, epochs=10, lr=1e-3):
+    device = next(autoencoder.parameters()).device
+    optimizer = torch.optim.Adam(autoencoder.parameters(), lr=lr)
+
+    autoencoder.train()
+    for epoch in range(epochs):
+        for step, batch in enumerate(dataloader):
+            optimizer.zero_grad()
+
+            batch = batch.to(device)
+            recon = autoencoder(batch)
+            loss = F.l1_loss(recon, batch) + F.mse_loss(recon, batch)
+
+            if step % 100 == 0:
+                print("Loss:", loss.item())
+
+            loss.backward()
+            optimizer.step()
+    autoencoder.eval()
+    return autoencoder
+
+
+# one-time encoding pass: every image -> one row of a memory-mapped latent array
+@torch.no_grad()
+def encode_dataset(autoencoder, dataloader, store_dir):
+    device = next(autoencoder.parameters()).device
+    store_dir = Path(store_dir)
+    store_dir.mkdir(parents=True, exist_ok=True)
+
+    autoencoder.eval()
+    n = len(dataloader.dataset)
+    latents = None
+    offset = 0
+    for batch in tqdm(dataloader, desc='encoding dataset'):
+        z = autoencoder.encode(batch.to(device)).cpu().numpy()
+        if latents is None:
+            latents = np.lib.format.open_memmap(
+                store_dir / 'latents.npy', mode='w+', dtype=np.float16, shape=(n, *z.shape[1:])
+            )
+        latents[offset:offset + len(z)] = z
+        offset += len(z)
+    latents.flush()
+
+    # rescale latents to unit variance so the diffusion schedule fits them like pixels in [-1, 1]
+    scale_factor = float(1.0 / np.asarray(latents, dtype=np.float32).std())
+
+    torch.save(autoencoder.state_dict(), store_dir / 'autoencoder.pt')
+    meta = {
+        "shape": list(latents.shape),
+        "scale_factor": scale_factor,
+        "latent_channels": autoencoder.latent_channels,
+        "channels": autoencoder.channels,
+    }
+    with open(store_dir / 'meta.json', 'w') as f:
+        json.dump(meta, f, indent=2)
+    return meta
+
+
+def load_latent_meta(store_dir):
+    with open(Path(store_dir) / 'meta.json', 'r') as f:
+        return json.load(f)
+
+
+def load_autoencoder(store_dir, device="cpu"):
+    meta = load_latent_meta(store_dir)
+    autoencoder = Autoencoder(channels=meta["channels"], latent_channels=meta["latent_channels"])
+    autoencoder.load_state_dict(torch.load(Path(store_dir) / 'autoencoder.pt', map_location=device))
+    return autoencoder.to(device).eval()
+
+
+@torch.no_grad()
+def decode_latents(autoencoder, latents, scale_factor, batch_size=64):
+    device = next(autoencoder.parameters()).device
+    latents = torch.as_tensor(np.asarray(latents), dtype=torch.float32)
+
+    images = []
+    for z in latents.split(batch_size):
+        images.append(autoencoder.decode(z.to(device) / scale_factor).cpu())
+    return torch.cat(images).numpy()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the latent autoencoder and encode FFHQ once.")
+    parser.add_argument('--image-dir', default='FFHQ')
+    parser.add_argument('--store-dir', default='latents')
+    parser.add_argument('--epochs', type=int, default=10)
+    parser.add_argument('--batch-size', type=int, default=64)
+    args = parser.parse_args()
+
+    import dataset
+    from torchvision import transforms
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    to_tensor = [transforms.ToTensor(), transforms.Lambda(lambda t: (t * 2) - 1)]
+
+    train_data = dataset.Ffhq(img_dir=args.image_dir,
+                              transform=transforms.Compose([transforms.RandomHorizontalFlip(), *to_tensor]))
+    encode_data = dataset.Ffhq(img_dir=args.image_dir, transform=transforms.Compose(to_tensor))
+
+    autoencoder = Autoencoder().to(device)
+    train_autoencoder(autoencoder, DataLoader(train_data, batch_size=args.batch_size, shuffle=True),
+                      epochs=args.epochs)
+
+    meta = encode_dataset(autoencoder, DataLoader(encode_data, batch_size=args.batch_size, shuffle=False),
+                          args.store_dir)
+    print(f"Encoded {meta['shape'][0]} images to {args.store_dir} (latent shape {meta['shape'][1:]})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+import sys
+import json
+import time
+import argparse
+import subprocess
+import statistics
+
+
+# modules a sampling worker must not pay for at import time
+HEAVY_MODULES = ("matplotlib", "torchvision", "datasets", "cv2", "pandas")
+
+CHILD = """
+import sys, time, json
+start = time.perf_counter()
+import torch
+torch_done = time.perf_counter()
+import {module}
+done = time.perf_counter()
+heavy = sorted({{name.split('.')[0] for name in sys.modules}} & set({heavy!r}))
+print(json.dumps({{"torch": torch_done - start, "total": done - start, "heavy": heavy}}))
+"""
+
+
+def measure(module, repeats=5):
+    """Import `module` in fresh interpreters and return per-run timings.
+
+    "startup" is the wall time of the whole child process, interpreter start-up
+    and shutdown included: what a freshly launched sampling worker waits for.
+    """
+    runs = []
+    for _ in range(repeats):
+        code = CHILD.format(module=module, heavy=HEAVY_MODULES)
+        start = time.perf_counter()
+        output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+        startup = time.perf_counter() - start
+        runs.append({**json.loads(output.stdout.strip().splitlines()[-1]), "startup": startup})
+    return runs
+
+
+def slowest_imports(module, top=10):
+    """Cumulative import times (us) reported by `python -X importtime`, slowest first."""
+    output = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            capture_output=True, text=True, check=True)
+    rows = []
+    for line in output.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative_us, name = line.split("|")
+        rows.append((int(cumulative_us), name.strip()))
+    return sorted(rows, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark cold import time of the library modules.")
+    parser.add_argument("modules", nargs="*", default=["model", "DDIM", "sample_server"])
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--budget", type=float, default=0.5,
+                        help="seconds allowed for the import on top of an already imported torch")
+    parser.add_argument("--startup-budget", type=float, default=1.0,
+                        help="seconds allowed for starting a process that imports the module, torch included "
+                             "(the sampling worker start-up target)")
+    args = parser.parse_args()
+
+    failed = False
+    for module in args.modules:
+        runs = measure(module, args.repeats)
+        total = statistics.median(run["total"] for run in runs)
+        torch_time = statistics.median(run["torch"] for run in runs)
+        # torch is preloaded before the module, so --budget only covers this repo's own import cost;
+        # --startup-budget holds the whole worker start-up to the sub-second target
+        own = statistics.median(run["total"] - run["torch"] for run in runs)
+        startup = statistics.median(run["startup"] for run in runs)
+        heavy = sorted(set().union(*(run["heavy"] for run in runs)))
+
+        print(f"{module}: {total:.3f}s median cold import ({torch_time:.3f}s of it torch, "
+              f"{own:.3f}s the rest), {startup:.3f}s process start-up "
+              f"(budget {args.startup_budget:.3f}s)")
+        for cumulative_us, name in slowest_imports(module):
+            print(f"    {cumulative_us / 1e6:7.3f}s  {name}")
+        if heavy:
+            print(f"    heavy modules imported: {', '.join(heavy)}")
+        if heavy or own > args.budget or startup > args.startup_budget:
+            failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
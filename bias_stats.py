@@ -0,0 +1,276 @@
+import json
+import argparse
+from itertools import combinations
+
+import numpy as np
+
+from check_values import valid_values
+from label_store import read_labels
+from split_result import ASPECT_FILENAME_MAP, IDENTITY_FILENAME_MAP
+
+IDENTITIES = list(IDENTITY_FILENAME_MAP)
+ASPECTS = list(ASPECT_FILENAME_MAP)
+LABELS = {aspect: sorted(valid_values[aspect]) for aspect in ASPECTS}
+BASELINE = "id_free"
+
+
+def column_codes(table, name):
+    """(indices, dictionary) of a dictionary-encoded column of a table with unified dictionaries."""
+    column = table.column(name)
+    if column.num_chunks == 0:
+        return np.empty(0, dtype=np.int64), []
+    indices = np.concatenate([chunk.indices.to_numpy(zero_copy_only=False) for chunk in column.chunks])
+    return indices.astype(np.int64), column.chunk(0).dictionary.to_pylist()
+
+
+def vocabulary_lookup(dictionary, vocabulary):
+    # dictionary index -> position in `vocabulary`, -1 for values outside it
+    return np.array([vocabulary.index(value) if value in vocabulary else -1 for value in dictionary], dtype=np.int64)
+
+
+def encode(table):
+    """Label codes of label store rows as an images × identities × aspects int8 array.
+
+    Codes index LABELS[aspect]; cells without a label are -1. Returns the image
+    names (in array order) and the array.
+    """
+    table = table.unify_dictionaries()
+    image_index, images = column_codes(table, "image")
+    identity_index, identities = column_codes(table, "identity")
+    aspect_index, aspects = column_codes(table, "aspect")
+    label_index, labels = column_codes(table, "label")
+
+    identity_code = vocabulary_lookup(identities, IDENTITIES)[identity_index]
+    aspect_code = vocabulary_lookup(aspects, ASPECTS)[aspect_index]
+    label_lookup = np.stack([vocabulary_lookup(labels, LABELS[aspect]) for aspect in ASPECTS]).reshape(len(ASPECTS), -1)
+    keep = (identity_code >= 0) & (aspect_code >= 0)
+
+    codes = np.full((len(images), len(IDENTITIES), len(ASPECTS)), -1, dtype=np.int8)
+    codes[image_index[keep], identity_code[keep], aspect_code[keep]] = \
+        label_lookup[aspect_code[keep], label_index[keep]]
+
+    # a filtered read keeps the whole dictionary, including images without rows
+    present = np.zeros(len(images), dtype=bool)
+    present[image_index] = True
+    return [image for image, used in zip(images, present) if used], codes[present]
+
+
+def load_codes(path, model=None):
+    return encode(read_labels(path, ["image", "identity", "aspect", "label"], model=model))
+
+
+def store_models(path):
+    table = read_labels(path, ["model"]).unify_dictionaries()
+    indices, dictionary = column_codes(table, "model")
+    return [dictionary[index] for index in np.unique(indices)]
+
+
+def rater_features(patterns, n_labels):
+    """Per-pattern indicators whose weighted sums determine every statistic.
+
+    patterns: (U, R) label codes of R raters (-1 = no label). All features are
+    linear in the image weights, so resampled statistics only need one matrix
+    product per feature.
+    """
+    raters = patterns.shape[1]
+    valid = patterns >= 0
+    onehot = (patterns[..., None] == np.arange(n_labels)).astype(np.float32)
+    pair_valid = (valid[:, :, None] & valid[:, None, :]).astype(np.float32)
+    complete = valid.all(axis=1).astype(np.float32)
+    # Fleiss' kappa needs every rater on an image, so only complete images count towards it
+    counts = onehot.sum(axis=1) * complete[:, None]
+    pair_agreement = ((counts ** 2).sum(axis=1) - raters * complete) / max(raters * (raters - 1), 1)
+    return {
+        "onehot": onehot,                                              # (U, R, K)
+        "pair_valid": pair_valid,                                      # (U, R, R)
+        "agree": np.einsum("uik,ujk->uij", onehot, onehot),            # (U, R, R)
+        "marginal": onehot[:, :, None, :] * pair_valid[..., None],     # (U, R, R, K): rater i where j also rated
+        "complete": complete,                                          # (U,)
+        "counts": counts,                                              # (U, K)
+        "pair_agreement": pair_agreement,                              # (U,)
+    }
+
+
+def weighted_sums(patterns, weights, n_labels, chunk=4096):
+    """Sums of rater_features over the patterns, weighted by `weights` (shape (U,) or (B, U)).
+
+    Patterns are processed in chunks, so memory stays bounded however many
+    distinct patterns there are.
+    """
+    sums = None
+    for start in range(0, len(patterns), chunk):
+        features = rater_features(patterns[start:start + chunk], n_labels)
+        w = np.asarray(weights[..., start:start + chunk], dtype=np.float32)
+        part = {name: np.tensordot(w, value, axes=([-1], [0])) for name, value in features.items()}
+        sums = part if sums is None else {name: sums[name] + part[name] for name in sums}
+    return sums
+
+
+def kl_divergence(p, q):
+    # a rater without labels has an all-NaN distribution and stays NaN
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(p > 0, p * np.log2(p / q), np.where(p == 0, 0.0, np.nan)).sum(axis=-1)
+
+
+def js_divergence(p, q):
+    """Jensen-Shannon divergence in bits along the last axis (0 = identical, 1 = disjoint)."""
+    m = (p + q) / 2
+    return (kl_divergence(p, m) + kl_divergence(q, m)) / 2
+
+
+def statistics(sums, raters, baseline=None):
+    """Statistics from weighted_sums; every array keeps the leading resample axis, if any.
+
+    distribution (R, K) label distribution per rater, cohen_kappa (R, R), fleiss_kappa ();
+    with a baseline rater also disagreement (R,) (share of images where the rater's
+    label differs from the baseline's) and js_divergence (R,) from its distribution.
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        distribution = sums["onehot"] / sums["onehot"].sum(axis=-1, keepdims=True)
+
+        observed = sums["agree"] / sums["pair_valid"]
+        marginal = sums["marginal"] / sums["pair_valid"][..., None]
+        expected = (marginal * np.swapaxes(marginal, -2, -3)).sum(axis=-1)
+        cohen_kappa = (observed - expected) / (1 - expected)
+
+        complete = sums["complete"]
+        label_share = sums["counts"] / (complete[..., None] * raters)
+        fleiss_expected = (label_share ** 2).sum(axis=-1)
+        fleiss_kappa = (sums["pair_agreement"] / complete - fleiss_expected) / (1 - fleiss_expected)
+
+    result = {"distribution": distribution, "cohen_kappa": cohen_kappa, "fleiss_kappa": fleiss_kappa}
+    if baseline is not None:
+        result["disagreement"] = 1 - observed[..., :, baseline]
+        result["js_divergence"] = js_divergence(distribution, distribution[..., baseline:baseline + 1, :])
+    return result
+
+
+def agreement_stats(codes, n_labels, baseline=None, resamples=0, confidence=0.95, seed=0, chunk=4096):
+    """Point estimates and bootstrap confidence intervals of `statistics` for an images × raters code array.
+
+    Images with the same labels from every rater are collapsed into one pattern
+    with a count, and a bootstrap resample of the images is drawn directly as
+    multinomial pattern counts; all resamples are evaluated together as one
+    (resamples × patterns) weight matrix.
+
+    Returns:
+        (dict, dict or None): the statistics, and {name: (lower, upper)} arrays of
+        the `confidence` percentile intervals (None without resamples).
+    """
+    raters = codes.shape[1]
+    if len(codes) == 0:
+        return statistics(empty_sums(raters, n_labels), raters, baseline), None
+    patterns, counts = np.unique(codes, axis=0, return_counts=True)
+    point = statistics(weighted_sums(patterns, counts, n_labels, chunk), raters, baseline)
+    if not resamples:
+        return point, None
+
+    rng = np.random.default_rng(seed)
+    weights = rng.multinomial(len(codes), counts / len(codes), size=resamples)
+    samples = statistics(weighted_sums(patterns, weights, n_labels, chunk), raters, baseline)
+    alpha = (1 - confidence) / 2
+    with np.errstate(invalid="ignore"):
+        intervals = {name: tuple(np.nanquantile(value, [alpha, 1 - alpha], axis=0))
+                     for name, value in samples.items()}
+    return point, intervals
+
+
+def empty_sums(raters, n_labels):
+    features = rater_features(np.zeros((0, raters), dtype=np.int8), n_labels)
+    return {name: value.sum(axis=0) for name, value in features.items()}
+
+
+def rounded(value):
+    # JSON-ready nested lists; undefined statistics (no overlapping labels) become null
+    value = np.asarray(value, dtype=np.float64)
+    return np.where(np.isnan(value), None, np.round(value, 4)).tolist()
+
+
+def identity_report(codes, aspect, resamples, confidence, seed):
+    labels = LABELS[aspect]
+    point, intervals = agreement_stats(codes, len(labels), IDENTITIES.index(BASELINE), resamples, confidence, seed)
+
+    def interval(name, *index):
+        if intervals is None:
+            return None
+        lower, upper = intervals[name]
+        return [rounded(lower[index]), rounded(upper[index])]
+
+    identities = {}
+    for i, identity in enumerate(IDENTITIES):
+        identities[identity] = {
+            "distribution": dict(zip(labels, rounded(point["distribution"][i]))),
+            "distribution_ci": interval("distribution", i),
+            "disagreement_with_baseline": rounded(point["disagreement"][i]),
+            "disagreement_ci": interval("disagreement", i),
+            "js_divergence_from_baseline": rounded(point["js_divergence"][i]),
+            "js_divergence_ci": interval("js_divergence", i),
+            "cohen_kappa": dict(zip(IDENTITIES, rounded(point["cohen_kappa"][i]))),
+        }
+    return {
+        "images": len(codes),
+        "labels": labels,
+        "fleiss_kappa": rounded(point["fleiss_kappa"]),
+        "fleiss_kappa_ci": interval("fleiss_kappa"),
+        "identities": identities,
+    }
+
+
+def cross_model_report(encoded, resamples, confidence, seed):
+    """Cohen's kappa between every pair of models, per identity and aspect, on the images both labelled."""
+    report = {}
+    for model_a, model_b in combinations(encoded, 2):
+        images_a, codes_a = encoded[model_a]
+        images_b, codes_b = encoded[model_b]
+        common, index_a, index_b = np.intersect1d(np.array(images_a, dtype=object), np.array(images_b, dtype=object),
+                                                  return_indices=True)
+        pair = {"images": len(common)}
+        for a, aspect in enumerate(ASPECTS):
+            pair[aspect] = {}
+            for i, identity in enumerate(IDENTITIES):
+                codes = np.stack([codes_a[index_a, i, a], codes_b[index_b, i, a]], axis=1)
+                point, intervals = agreement_stats(codes, len(LABELS[aspect]), None, resamples, confidence, seed)
+                pair[aspect][identity] = {
+                    "cohen_kappa": rounded(point["cohen_kappa"][0, 1]),
+                    "cohen_kappa_ci": None if intervals is None else
+                    [rounded(bound[..., 0, 1]) for bound in intervals["cohen_kappa"]],
+                }
+        report[f"{model_a}|{model_b}"] = pair
+    return report
+
+
+def analyze(path, models=None, resamples=1000, confidence=0.95, seed=0):
+    """Per-model identity bias and agreement statistics of a label store, plus cross-model agreement."""
+    models = models or store_models(path)
+    encoded = {model: load_codes(path, model) for model in models}
+    report = {"models": {}}
+    for model, (images, codes) in encoded.items():
+        report["models"][model] = {aspect: identity_report(codes[:, :, a], aspect, resamples, confidence, seed)
+                                   for a, aspect in enumerate(ASPECTS)}
+    if len(encoded) > 1:
+        report["cross_model"] = cross_model_report(encoded, resamples, confidence, seed)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Identity bias and agreement statistics of a Parquet label store.")
+    parser.add_argument("path", help="label store written by label_store.py convert")
+    parser.add_argument("--model", action="append", default=None,
+                        help="model to analyze (repeatable; default: every model in the store)")
+    parser.add_argument("--resamples", type=int, default=1000, help="bootstrap resamples (0 disables intervals)")
+    parser.add_argument("--confidence", type=float, default=0.95)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="write the JSON report here instead of printing it")
+    args = parser.parse_args()
+
+    report = analyze(args.path, args.model, args.resamples, args.confidence, args.seed)
+    text = json.dumps(report, indent=2)
+    if args.output is None:
+        print(text)
+    else:
+        with open(args.output, 'w') as f:
+            f.write(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,33 @@
 import json
 
+from normalize_emotion import emotion_mapping
+
+# 定义目标值集合
+valid_quality_aesthetic = {'positive', 'normal', 'negative'}
+valid_emotions = {'amusement', 'excitement', 'contentment', 'awe', 
+                 'disgust', 'sadness', 'fear', 'neutral'}
+
+# 每个评估维度的合法取值
+valid_values = {
+    'quality': valid_quality_aesthetic,
+    'aesthetic': valid_quality_aesthetic,
+    'emotion': valid_emotions
+}
+
+def normalize_cell(aspect, value):
+    """(value, valid) of one identity/aspect cell.
+
+    Emotions are mapped with `emotion_mapping` before the value is checked
+    against `valid_values`. Anything but a string (a list, an object, a number)
+    is invalid and returned unchanged.
+    """
+    if not isinstance(value, str):
+        return value, False
+    if aspect == 'emotion':
+        value = emotion_mapping.get(value, value)
+    return value, value in valid_values[aspect]
+
 def check_values(data):
-    # 定义目标值集合
-    valid_quality_aesthetic = {'positive', 'normal', 'negative'}
-    valid_emotions = {'amusement', 'excitement', 'contentment', 'awe', 
-                     'disgust', 'sadness', 'fear', 'neutral'}
-    
     # 存储异常值
     invalid_values = {
         'quality': set(),
@@ -31,15 +53,16 @@ def check_values(data):
     
     return invalid_values
 
-# 读取JSON文件
-with open('process/gemini_normalized_results.json', 'r') as f:
-    data = json.load(f)
+if __name__ == '__main__':
+    # 读取JSON文件
+    with open('process/gemini_normalized_results.json', 'r') as f:
+        data = json.load(f)
 
-# 检查非目标值
-invalid_values = check_values(data)
+    # 检查非目标值
+    invalid_values = check_values(data)
 
-# 打印结果
-print("Invalid values found:")
-print("Quality:", invalid_values['quality'] if invalid_values['quality'] else "None")
-print("Aesthetic:", invalid_values['aesthetic'] if invalid_values['aesthetic'] else "None")
-print("Emotion:", invalid_values['emotion'] if invalid_values['emotion'] else "None")
+    # 打印结果
+    print("Invalid values found:")
+    print("Quality:", invalid_values['quality'] if invalid_values['quality'] else "None")
+    print("Aesthetic:", invalid_values['aesthetic'] if invalid_values['aesthetic'] else "None")
+    print("Emotion:", invalid_values['emotion'] if invalid_values['emotion'] else "None")
@@ -1,13 +1,10 @@
 import torch
 from torch.utils.data import Dataset
-from torchvision import datasets
-from torchvision.transforms import ToTensor
-import matplotlib.pyplot as plt
 
 
 import os
-import pandas as pd
-from torchvision.io import read_image
+import json
+import numpy as np
 from PIL import Image
 
 class Ffhq(Dataset):
@@ -15,28 +12,70 @@ class Ffhq(Dataset):
           self.img_dir = img_dir
           self.transform = transform
           # self.mode = mode
-          self.train_dataset = []
-          self.test_dataset = []
-          self.file_list = []
+          self.file_list = sorted(
+               f for f in os.listdir(self.img_dir) if f.lower().endswith(('.png', '.jpg', '.jpeg'))
+          )
 
 
      def __len__(self):
-          return len(self.train_dataset)
+          return len(self.file_list)
      
      def __getitem__(self, index):
-          self.train_data_dir = self.img_dir
-          self.file_list.extend(os.listdir(self.train_data_dir))
-
-          for i, file in enumerate(self.file_list):
-               self.train_dataset.append([file])
-          dataset = self.train_dataset
-          filename = dataset[index]
+          filename = self.file_list[index]
           
-          image = Image.open(os.path.join(self.train_data_dir, filename))
+          image = Image.open(os.path.join(self.img_dir, filename)).convert("RGB")
 
           return self.transform(image)
 
 
+# latents written once by autoencoder.encode_dataset, read through a memory map
+class FfhqLatents(Dataset):
+     def __init__(self, store_dir):
+          with open(os.path.join(store_dir, 'meta.json'), 'r') as f:
+               self.meta = json.load(f)
+          self.scale_factor = self.meta["scale_factor"]
+          self.latents = np.load(os.path.join(store_dir, 'latents.npy'), mmap_mode='r')
+
+     def __len__(self):
+          return len(self.latents)
+
+     def __getitem__(self, index):
+          latent = torch.from_numpy(np.asarray(self.latents[index], dtype=np.float32))
+          return latent * self.scale_factor
+
+
+# FFHQ resized once to `size` and stored as a uint8 (N, size, size, 3) memmap
+def build_resolution_cache(img_dir, cache_dir, size):
+     os.makedirs(cache_dir, exist_ok=True)
+     path = os.path.join(cache_dir, f'ffhq_{size}.npy')
+     file_list = Ffhq(img_dir, transform=None).file_list
+
+     if os.path.exists(path):
+          cached = np.load(path, mmap_mode='r')
+          if cached.shape == (len(file_list), size, size, 3):
+               return path
+
+     images = np.lib.format.open_memmap(path, mode='w+', dtype=np.uint8, shape=(len(file_list), size, size, 3))
+     for i, filename in enumerate(file_list):
+          with Image.open(os.path.join(img_dir, filename)) as image:
+               image = image.convert("RGB").resize((size, size), Image.Resampling.LANCZOS)
+               images[i] = np.asarray(image)
+     images.flush()
+     return path
+
+
+class FfhqCache(Dataset):
+     def __init__(self, cache_path, transform):
+          self.transform = transform
+          self.images = np.load(cache_path, mmap_mode='r')
+
+     def __len__(self):
+          return len(self.images)
+
+     def __getitem__(self, index):
+          return self.transform(Image.fromarray(np.asarray(self.images[index])))
+
+
 
 
 # training_data = datasets.FashionMNIST(
@@ -3,14 +3,50 @@ from http import HTTPStatus
 import requests
 import json
 import base64
-from lmdeploy.serve.openai.api_client import APIClient
+
+QWEN_URL = "http://10.90.86.76:6008/v1/chat/completions"
+QWEN_MODEL = "Qwen2_5-72B"
+
+# one keep-alive connection for every call from this process
+session = requests.Session()
 
 def encode_image(image_path):
     with open(image_path, "rb") as image_file:
         return base64.b64encode(image_file.read()).decode('utf-8')
 
 
-def query_qwen25(messages, temperature=0., max_tokens=1500):
+# leading bytes of the image formats the endpoint accepts
+IMAGE_SIGNATURES = [
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"BM", "image/bmp"),
+]
+
+
+def image_mime(image_b64):
+    # the first 16 base64 characters decode to the first 12 bytes, enough for every signature
+    prefix = image_b64[:16]
+    header = base64.b64decode(prefix[:len(prefix) - len(prefix) % 4])
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return "image/webp"
+    for signature, mime in IMAGE_SIGNATURES:
+        if header.startswith(signature):
+            return mime
+    return "image/jpeg"
+
+
+def image_url(image, mime=None):
+    # base64 data (as returned by encode_image) becomes a data URL typed from its magic bytes,
+    # URLs are passed through
+    if image.startswith(("data:", "http://", "https://")):
+        return image
+    return "data:%s;base64,%s" % (mime or image_mime(image), image)
+
+
+# our {"role", "content": [{"text": ...} | {"image": ...}]} messages -> OpenAI-compatible chat messages
+def to_openai_messages(messages):
     intern_messages = []
     for message in messages:
         intern_content = []
@@ -20,42 +56,128 @@ def query_qwen25(messages, temperature=0., max_tokens=1500):
                     "type": "text",
                     "text": content["text"]
                 })
+            elif "image" in content:
+                intern_content.append({
+                    "type": "image_url",
+                    "image_url": {"url": image_url(content["image"])}
+                })
+            elif "type" in content:
+                # already in OpenAI form
+                intern_content.append(content)
         intern_messages.append({
             "role": message["role"],
             "content": intern_content
         })
+    return intern_messages
 
-    headers = {"Content-Type": "application/json"}
-    payload = {
-        "model": "Qwen2_5-72B",
-        "messages": intern_messages,
+
+def build_payload(messages, temperature=0., max_tokens=1500, model=QWEN_MODEL):
+    return {
+        "model": model,
+        "messages": to_openai_messages(messages),
         "temperature": temperature,
         "max_tokens": max_tokens
     }
-    response = requests.post("http://10.90.86.76:6008/v1/chat/completions", headers=headers, json=payload)
-    if response.status_code != HTTPStatus.OK:
-        raise ValueError('Request id: %s, Status code: %s, error code: %s, error message: %s' % (
-            response.request_id, response.status_code,
-            response.code, response.message
-        ))
-    response_output = response.json()
-    role, content = response_output['choices'][0]['message']['role'], response_output['choices'][0]['message']['content']
 
-    return role, content
 
-if __name__ == '__main__':
+def parse_completion(response_output):
+    message = response_output['choices'][0]['message']
+    return message['role'], message['content']
 
-    messages = []
-    messages.append({
-        "role": "system",
-        "content": [{'text': "You are an assisst to help me generate the prompt for Diffusion Model to generate image."}]
-    })
-    messages.append({
-            'role': 'user',
-            'content': [
-                {
-                    'text': 
+
+# cache: optional llm_cache.LLMCache; identical requests are then answered without a call
+def query_qwen25(messages, temperature=0., max_tokens=1500, timeout=300, cache=None):
+    headers = {"Content-Type": "application/json"}
+    payload = build_payload(messages, temperature, max_tokens)
+    response_output = cache.get(payload) if cache is not None else None
+    if response_output is None:
+        response = session.post(QWEN_URL, headers=headers, json=payload, timeout=timeout)
+        if response.status_code != HTTPStatus.OK:
+            raise ValueError('Status code: %s, error message: %s' % (response.status_code, response.text[:1000]))
+        response_output = response.json()
+        if cache is not None:
+            cache.put(payload, response_output)
+    return parse_completion(response_output)
+
+
+class StreamState:
+    """Accumulates a server-sent chat completion stream ("data: {chunk}" lines).
+
+    `feed` returns True once the stream is over: at "data: [DONE]", or as soon
+    as `stop_when(content so far)` holds, so the caller can close the connection
+    instead of paying for a run-on generation.
     """
+
+    def __init__(self, stop_when=None):
+        self.stop_when = stop_when
+        self.start = time.monotonic()
+        self.first_token = None
+        self.role = "assistant"
+        self.content = ""
+        self.chunks = 0
+        self.finish_reason = None
+        self.usage = None
+        self.stopped_early = False
+
+    def feed(self, line):
+        line = line.strip()
+        if not line.startswith("data:"):
+            return False
+        data = line[len("data:"):].strip()
+        if data == "[DONE]":
+            return True
+        chunk = json.loads(data)
+        self.usage = chunk.get("usage") or self.usage
+        if not chunk.get("choices"):
+            return False
+        choice = chunk["choices"][0]
+        delta = choice.get("delta") or {}
+        self.role = delta.get("role") or self.role
+        self.finish_reason = choice.get("finish_reason") or self.finish_reason
+        if delta.get("content"):
+            if self.first_token is None:
+                self.first_token = time.monotonic() - self.start
+            self.content += delta["content"]
+            self.chunks += 1
+            if self.stop_when is not None and self.stop_when(self.content):
+                self.stopped_early = True
+                return True
+        return False
+
+    def response(self):
+        # same layout as a non-streamed completion, so parse_completion and the cache work unchanged
+        return {
+            "choices": [{
+                "message": {"role": self.role, "content": self.content},
+                "finish_reason": "early_stop" if self.stopped_early else self.finish_reason,
+            }],
+            "usage": self.usage or {"completion_tokens": self.chunks, "total_tokens": self.chunks},
+            "stream": {
+                "time_to_first_token": self.first_token,
+                "seconds": time.monotonic() - self.start,
+                "stopped_early": self.stopped_early,
+            },
+        }
+
+
+# streamed query_qwen25; returns (role, content, stream info with time_to_first_token and stopped_early)
+def stream_qwen25(messages, temperature=0., max_tokens=1500, timeout=300, stop_when=None):
+    headers = {"Content-Type": "application/json"}
+    payload = {**build_payload(messages, temperature, max_tokens), "stream": True}
+    state = StreamState(stop_when)
+    with session.post(QWEN_URL, headers=headers, json=payload, timeout=timeout, stream=True) as response:
+        if response.status_code != HTTPStatus.OK:
+            raise ValueError('Status code: %s, error message: %s' % (response.status_code, response.text[:1000]))
+        for line in response.iter_lines(decode_unicode=True):
+            if line and state.feed(line):
+                break
+    output = state.response()
+    role, content = parse_completion(output)
+    return role, content, output["stream"]
+
+
+PROMPT_SYSTEM = "You are an assisst to help me generate the prompt for Diffusion Model to generate image."
+PROMPT_TASK = """
     ### Task
     I have a violation description that is broken down into multiple levels or stages. 
     Please understand the reason for this violation, and then generate a prompt for Stable Diffusion that will create an image based on this violation. The prompt should instruct the model to generate an image that is a direct result of this violation.
@@ -64,11 +186,30 @@ if __name__ == '__main__':
     <prompt>
 
     ### Rule
-    Finance Related->Financial Products->Cryptocurrency->Cryptocurrency Logos->Initial Coin Offering (ICO) Logos->Project Logotypes
+    {rule}
     """
-        },
-    ]
+
+
+# messages asking for a Stable Diffusion prompt for one violation rule ("A->B->...->F");
+# the rule comes last, so requests for related rules share the longest possible prefix
+def prompt_messages(rule):
+    messages = []
+    messages.append({
+        "role": "system",
+        "content": [{'text': PROMPT_SYSTEM}]
+    })
+    messages.append({
+        'role': 'user',
+        'content': [{'text': PROMPT_TASK.format(rule=rule)}]
     })
+    return messages
+
+
+if __name__ == '__main__':
+
+    messages = prompt_messages(
+        "Finance Related->Financial Products->Cryptocurrency->Cryptocurrency Logos->Initial Coin Offering (ICO) Logos->Project Logotypes"
+    )
 
     role, content = query_qwen25(messages, temperature=0., max_tokens=1500)
     print(content)
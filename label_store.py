@@ -0,0 +1,141 @@
+import json
+import argparse
+from collections import Counter
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from check_values import normalize_cell
+from postprocess import iter_results
+from split_result import ASPECT_FILENAME_MAP, IDENTITY_FILENAME_MAP
+
+COLUMNS = ["image", "model", "identity", "aspect", "label"]
+# every column repeats a small set of strings, so all of them are stored as dictionary indices
+SCHEMA = pa.schema([(name, pa.dictionary(pa.int32(), pa.string())) for name in COLUMNS])
+
+
+def iter_labels(results_path, model):
+    """(image, model, identity, aspect, label) rows of the valid cells of a results file.
+
+    Image names lose their .jpg extension and cells are normalized with
+    check_values.normalize_cell, exactly as for the split files, so lists,
+    objects and other non-string values are skipped as invalid.
+    """
+    for image, analysis in iter_results(results_path):
+        if not isinstance(analysis, dict):
+            continue
+        image_name = image.replace('.jpg', '')
+        for identity in IDENTITY_FILENAME_MAP:
+            group = analysis.get(identity)
+            if not isinstance(group, dict):
+                continue
+            for aspect in ASPECT_FILENAME_MAP:
+                value = group.get(aspect)
+                if value is None:
+                    continue
+                value, valid = normalize_cell(aspect, value)
+                if valid:
+                    yield image_name, model, identity, aspect, value
+
+
+class LabelStoreWriter:
+    """Appends label rows to a Parquet file in row groups of `batch_rows`, so conversion runs in constant memory."""
+
+    def __init__(self, path, batch_rows=100_000):
+        self.writer = pq.ParquetWriter(path, SCHEMA, compression="zstd")
+        self.batch_rows = batch_rows
+        self.rows = []
+        self.count = 0
+
+    def add(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= self.batch_rows:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        columns = zip(*self.rows)
+        arrays = [pa.array(column, pa.string()).dictionary_encode() for column in columns]
+        self.writer.write_batch(pa.record_batch(arrays, schema=SCHEMA))
+        self.count += len(self.rows)
+        self.rows = []
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def convert(sources, path, batch_rows=100_000):
+    """Writes the labels of every (model, results_path) in `sources` to one Parquet file; returns the row count."""
+    with LabelStoreWriter(path, batch_rows) as writer:
+        for model, results_path in sources:
+            for row in iter_labels(results_path, model):
+                writer.add(row)
+    return writer.count
+
+
+def read_labels(path, columns=COLUMNS, **equals):
+    """The given columns of the rows whose columns equal `equals` (e.g. identity="male").
+
+    Only the requested and filtered columns are read from the file.
+    """
+    filters = [(name, "=", value) for name, value in equals.items() if value is not None]
+    return pq.read_table(path, columns=list(columns), filters=filters or None)
+
+
+def labels(path, identity, aspect, model=None):
+    """{image: label} for one identity and aspect: the content of one split file, without the trailing ';'."""
+    table = read_labels(path, ["image", "label"], identity=identity, aspect=aspect, model=model)
+    return dict(zip(table.column("image").to_pylist(), table.column("label").to_pylist()))
+
+
+def label_counts(path, identity, aspect, model=None):
+    """{label: count} for one identity and aspect."""
+    table = read_labels(path, ["label"], identity=identity, aspect=aspect, model=model)
+    return dict(Counter(table.column("label").to_pylist()))
+
+
+def parse_source(value):
+    # "gemini=process/gemini_normalized_results.json"
+    model, sep, results_path = value.partition("=")
+    if not sep:
+        raise argparse.ArgumentTypeError(f"expected MODEL=PATH, got {value!r}")
+    return model, results_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert annotation results to a Parquet label store, or query it.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    convert_parser = subparsers.add_parser("convert", help="write the labels of one or more result files")
+    convert_parser.add_argument("output", help="Parquet file to write")
+    convert_parser.add_argument("sources", nargs="+", type=parse_source,
+                                help="MODEL=PATH, PATH being annotate.py JSONL or {image: {...}} JSON")
+    convert_parser.add_argument("--batch-rows", type=int, default=100_000, help="rows per Parquet row group")
+
+    query_parser = subparsers.add_parser("query", help="label counts, or all labels, for one identity and aspect")
+    query_parser.add_argument("path")
+    query_parser.add_argument("identity", choices=list(IDENTITY_FILENAME_MAP))
+    query_parser.add_argument("aspect", choices=list(ASPECT_FILENAME_MAP))
+    query_parser.add_argument("--model", default=None)
+    query_parser.add_argument("--all", action="store_true", help="print {image: label} instead of counts")
+    args = parser.parse_args()
+
+    if args.command == "convert":
+        count = convert(args.sources, args.output, args.batch_rows)
+        print(f"Wrote {count} labels to {args.output}")
+    elif args.all:
+        print(json.dumps(labels(args.path, args.identity, args.aspect, args.model), indent=2))
+    else:
+        print(json.dumps(label_counts(args.path, args.identity, args.aspect, args.model), indent=2))
+
+
+if __name__ == "__main__":
+    main()
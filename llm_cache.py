@@ -0,0 +1,153 @@
+import json
+import time
+import sqlite3
+import hashlib
+import argparse
+import threading
+
+
+def normalize_content(part):
+    # inline images are keyed by a hash of their data instead of megabytes of base64
+    if part.get("type") == "image_url":
+        url = part["image_url"]["url"] if isinstance(part["image_url"], dict) else part["image_url"]
+        return {"type": "image_url", "sha256": hashlib.sha256(url.encode()).hexdigest()}
+    return part
+
+
+def request_key(payload):
+    """Content address of a chat completion payload (model, messages, temperature, max_tokens).
+
+    Payloads are built with gpt.build_payload, so our own and OpenAI-style messages
+    produce the same key; the JSON is canonicalized before hashing.
+    """
+    messages = [
+        {
+            "role": message["role"],
+            "content": [normalize_content(part) for part in message["content"]]
+            if isinstance(message["content"], list) else message["content"],
+        }
+        for message in payload["messages"]
+    ]
+    canonical = json.dumps({
+        "model": payload["model"],
+        "messages": messages,
+        "temperature": payload.get("temperature"),
+        "max_tokens": payload.get("max_tokens"),
+    }, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    """SQLite cache of chat completion responses, keyed by `request_key`.
+
+    Least recently used entries are evicted, down to 90% of `max_bytes`, once
+    the stored responses exceed `max_bytes`. The total size is tracked as a
+    running estimate and only recounted when the estimate passes the budget or
+    every `check_every` inserts (other processes may write too). The database
+    runs in WAL mode, so several annotation processes can share one cache file;
+    one instance is safe to use from several threads.
+    """
+
+    def __init__(self, path="llm_cache.sqlite", max_bytes=1 << 30, check_every=100):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.check_every = check_every
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, model TEXT, response TEXT, size INTEGER, created REAL, last_used REAL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+        self.db.commit()
+
+        # an over-estimate: replaced entries are counted twice until the next recount
+        self.estimated_size = self.size()
+        self.puts_since_check = 0
+
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, payload):
+        key = request_key(payload)
+        with self.lock:
+            row = self.db.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.db.execute("UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key))
+            self.db.commit()
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, payload, response):
+        data = json.dumps(response, ensure_ascii=False)
+        size = len(data.encode("utf-8"))
+        now = time.time()
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO responses (key, model, response, size, created, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (request_key(payload), payload["model"], data, size, now, now),
+            )
+            self.estimated_size += size
+            self.puts_since_check += 1
+            if self.estimated_size > self.max_bytes or self.puts_since_check >= self.check_every:
+                self.evict()
+            self.db.commit()
+
+    def size(self):
+        return self.db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def evict(self):
+        size = self.size()
+        self.puts_since_check = 0
+        self.estimated_size = size
+        if size <= self.max_bytes:
+            return
+        # drop the least recently used entries down to 90% of the budget, so a full cache is not recounted every put
+        excess = size - int(self.max_bytes * 0.9)
+        freed = 0
+        stale = []
+        for key, entry_size in self.db.execute("SELECT key, size FROM responses ORDER BY last_used"):
+            stale.append((key,))
+            freed += entry_size
+            if freed >= excess:
+                break
+        self.db.executemany("DELETE FROM responses WHERE key = ?", stale)
+        self.estimated_size = size - freed
+
+    def stats(self):
+        with self.lock:
+            entries, size = self.db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        return {"entries": entries, "bytes": size, "max_bytes": self.max_bytes, "hits": self.hits,
+                "misses": self.misses}
+
+    def clear(self):
+        with self.lock:
+            self.db.execute("DELETE FROM responses")
+            self.db.commit()
+            self.estimated_size = 0
+            self.db.execute("VACUUM")
+
+    def close(self):
+        self.db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or clear the LLM response cache.")
+    parser.add_argument("command", choices=["stats", "clear"])
+    parser.add_argument("--path", default="llm_cache.sqlite")
+    args = parser.parse_args()
+
+    cache = LLMCache(args.path)
+    if args.command == "clear":
+        cache.clear()
+    print(json.dumps(cache.stats(), indent=2))
+    cache.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,307 @@
+import json
+import time
+import random
+import asyncio
+import argparse
+from http import HTTPStatus
+from collections import deque
+
+import aiohttp
+
+from llm_cache import LLMCache
+from llm_control import AIMDLimiter, FixedLimiter, ThroughputMeter, TokenBucket
+from gpt import QWEN_URL, QWEN_MODEL, StreamState, build_payload, parse_completion
+
+RETRY_STATUSES = {HTTPStatus.TOO_MANY_REQUESTS, HTTPStatus.INTERNAL_SERVER_ERROR, HTTPStatus.BAD_GATEWAY,
+                  HTTPStatus.SERVICE_UNAVAILABLE, HTTPStatus.GATEWAY_TIMEOUT}
+# rough prompt cost of one image: a 1024 px image is about (1024 / 28) ** 2 visual tokens for Qwen2.5-VL
+IMAGE_TOKENS = 1300
+
+
+def estimate_prompt_tokens(messages):
+    """Rough prompt size of OpenAI-style messages: 4 characters per text token plus IMAGE_TOKENS per image.
+
+    Inline base64 image data is not text the model reads, so it is not counted by length.
+    """
+    characters, images = 0, 0
+    for message in messages:
+        content = message["content"]
+        if isinstance(content, str):
+            characters += len(content)
+            continue
+        for part in content:
+            if part.get("type") == "image_url":
+                images += 1
+            else:
+                characters += len(part.get("text", ""))
+    return characters // 4 + images * IMAGE_TOKENS
+
+
+class LLMError(Exception):
+    def __init__(self, status, message):
+        super().__init__(f"Status code: {status}, error message: {message}")
+        self.status = status
+        self.message = message
+
+
+class AsyncLLMClient:
+    """asyncio client for the OpenAI-compatible chat completions endpoint behind `query_qwen25`.
+
+    One pooled session keeps connections alive across requests, at most
+    `concurrency` requests are in flight, and every attempt has a timeout.
+    Timeouts, connection errors, 429 and 5xx responses are retried with full-jitter
+    exponential backoff (or after the server's Retry-After); other errors are raised
+    immediately. With a `cache` (llm_cache.LLMCache) identical requests are
+    answered from it and never reach the endpoint.
+
+    With adaptive=True the in-flight limit starts at `concurrency` and is
+    steered between 1 and `max_concurrency` by an AIMD controller fed with
+    latencies and 429/5xx responses. `requests_per_second` and
+    `tokens_per_second` additionally cap the request rate and the prompt plus
+    completion token rate (estimated up front, corrected from the response usage).
+
+        async with AsyncLLMClient() as client:
+            results = await client.query_many([messages_1, messages_2])
+    """
+
+    def __init__(self, url=QWEN_URL, model=QWEN_MODEL, concurrency=8, timeout=300, retries=5, backoff=1.0,
+                 max_backoff=60.0, cache=None, adaptive=False, max_concurrency=64, requests_per_second=None,
+                 tokens_per_second=None):
+        self.url = url
+        self.model = model
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.cache = cache
+
+        self.session = None
+        if adaptive:
+            self.limiter = AIMDLimiter(initial=concurrency, maximum=max_concurrency)
+            self.max_in_flight = max_concurrency
+        else:
+            self.limiter = FixedLimiter(concurrency)
+            self.max_in_flight = concurrency
+        self.request_bucket = TokenBucket(requests_per_second) if requests_per_second else None
+        self.token_bucket = TokenBucket(tokens_per_second) if tokens_per_second else None
+        self.meter = ThroughputMeter()
+        self.first_token_times = deque(maxlen=1000)
+        self.early_stops = 0
+
+        self.requests = 0
+        self.retried = 0
+        self.failed = 0
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def open(self):
+        if self.session is None:
+            connector = aiohttp.TCPConnector(limit=self.max_in_flight, keepalive_timeout=60)
+            self.session = aiohttp.ClientSession(connector=connector,
+                                                 timeout=aiohttp.ClientTimeout(total=self.timeout))
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def retry_delay(self, attempt, retry_after=None):
+        if retry_after is not None:
+            try:
+                return min(float(retry_after), self.max_backoff)
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    async def post(self, payload):
+        async with self.session.post(self.url, json=payload) as response:
+            if response.status != HTTPStatus.OK:
+                error = LLMError(response.status, (await response.text())[:1000])
+                error.retry_after = response.headers.get("Retry-After")
+                raise error
+            return await response.json(content_type=None)
+
+    async def post_stream(self, payload, stop_when=None):
+        state = StreamState(stop_when)
+        async with self.session.post(self.url, json={**payload, "stream": True}) as response:
+            if response.status != HTTPStatus.OK:
+                error = LLMError(response.status, (await response.text())[:1000])
+                error.retry_after = response.headers.get("Retry-After")
+                raise error
+            async for line in response.content:
+                if state.feed(line.decode("utf-8")):
+                    break
+            if state.stopped_early:
+                # drop the connection so the server stops generating
+                response.close()
+        output = state.response()
+        if output["stream"]["time_to_first_token"] is not None:
+            self.first_token_times.append(output["stream"]["time_to_first_token"])
+        self.early_stops += state.stopped_early
+        return output
+
+    async def complete(self, payload, stream=False, stop_when=None):
+        """POST one chat completion payload with retries; returns the parsed JSON response.
+
+        With stream=True the answer is streamed, and reading stops as soon as
+        `stop_when(content so far)` holds. Such truncated answers are not cached,
+        since the cache key does not know the stop condition and would serve them
+        to callers expecting the full completion; full answers serve both.
+        """
+        if self.cache is not None:
+            cached = self.cache.get(payload)
+            if cached is not None:
+                return cached
+            response = await self.request(payload, stream, stop_when)
+            if not response.get("stream", {}).get("stopped_early"):
+                self.cache.put(payload, response)
+            return response
+        return await self.request(payload, stream, stop_when)
+
+    def refund_tokens(self, amount):
+        if self.token_bucket is not None:
+            self.token_bucket.refund(amount)
+
+    async def request(self, payload, stream=False, stop_when=None):
+        await self.open()
+        # estimated prompt size plus the whole completion budget; corrected from the usage afterwards
+        estimate = estimate_prompt_tokens(payload["messages"]) + payload.get("max_tokens", 0)
+        for attempt in range(self.retries + 1):
+            retry_after = None
+            if self.request_bucket is not None:
+                await self.request_bucket.acquire()
+            if self.token_bucket is not None:
+                await self.token_bucket.acquire(estimate)
+            async with self.limiter:
+                self.requests += 1
+                start = time.monotonic()
+                try:
+                    if stream:
+                        response = await self.post_stream(payload, stop_when)
+                    else:
+                        response = await self.post(payload)
+                except LLMError as e:
+                    # an error response generated nothing, so its estimate goes back into the bucket
+                    self.refund_tokens(estimate)
+                    if e.status in RETRY_STATUSES:
+                        self.limiter.overload()
+                    if e.status not in RETRY_STATUSES or attempt == self.retries:
+                        self.failed += 1
+                        raise
+                    retry_after = e.retry_after
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    # a timed-out request may still have been generated server-side, a failed connection was not
+                    if not isinstance(e, asyncio.TimeoutError):
+                        self.refund_tokens(estimate)
+                    self.limiter.overload()
+                    if attempt == self.retries:
+                        self.failed += 1
+                        raise
+                else:
+                    self.limiter.success(time.monotonic() - start)
+                    used = response.get("usage", {}).get("total_tokens", 0)
+                    if used:
+                        self.refund_tokens(estimate - used)
+                    self.meter.record(used)
+                    return response
+            # the slot is released while waiting, so backing-off requests do not block others
+            self.retried += 1
+            await asyncio.sleep(self.retry_delay(attempt, retry_after))
+
+    def metrics(self):
+        requests_per_second, tokens_per_second = self.meter.rates()
+        return {
+            "requests_per_second": requests_per_second,
+            "tokens_per_second": tokens_per_second,
+            "concurrency_limit": self.limiter.limit,
+            "in_flight": self.limiter.in_flight,
+            "requests": self.requests,
+            "retried": self.retried,
+            "failed": self.failed,
+            "time_to_first_token": percentiles(self.first_token_times),
+            "early_stops": self.early_stops,
+        }
+
+    async def query(self, messages, temperature=0., max_tokens=1500, stream=False, stop_when=None):
+        """Async `query_qwen25`: returns (role, content).
+
+        stream=True streams the answer and stops reading once `stop_when(content)`
+        holds (e.g. the expected JSON object is complete).
+        """
+        payload = build_payload(messages, temperature, max_tokens, model=self.model)
+        return parse_completion(await self.complete(payload, stream, stop_when))
+
+    async def query_many(self, message_sets, return_exceptions=False, **kwargs):
+        """Query every message set concurrently; results are in input order.
+
+        With return_exceptions=True a failed request yields its exception instead of
+        failing the whole batch.
+        """
+        return await asyncio.gather(*(self.query(messages, **kwargs) for messages in message_sets),
+                                    return_exceptions=return_exceptions)
+
+
+def percentiles(values):
+    if not values:
+        return {"p50": None, "p95": None}
+    ordered = sorted(values)
+    return {"p50": ordered[len(ordered) // 2], "p95": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]}
+
+
+def add_rate_arguments(parser):
+    parser.add_argument("--adaptive", action="store_true",
+                        help="let an AIMD controller adjust concurrency (starting at --concurrency)")
+    parser.add_argument("--max-concurrency", type=int, default=64, help="upper bound with --adaptive")
+    parser.add_argument("--rps", type=float, default=None, help="maximum requests per second")
+    parser.add_argument("--tps", type=float, default=None, help="maximum prompt+completion tokens per second")
+
+
+def rate_options(args):
+    return {"adaptive": args.adaptive, "max_concurrency": args.max_concurrency,
+            "requests_per_second": args.rps, "tokens_per_second": args.tps}
+
+
+def query_batch(message_sets, concurrency=8, return_exceptions=False, cache=None, **kwargs):
+    """Blocking batch API: (role, content) for every message set, in order."""
+    async def run():
+        async with AsyncLLMClient(concurrency=concurrency, cache=cache) as client:
+            return await client.query_many(message_sets, return_exceptions=return_exceptions, **kwargs)
+
+    return asyncio.run(run())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Send a batch of identical chat requests and report throughput.")
+    parser.add_argument("--url", default=QWEN_URL)
+    parser.add_argument("--n", type=int, default=32)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--text", default="Reply with OK.")
+    parser.add_argument("--cache", default=None, help="SQLite response cache file")
+    add_rate_arguments(parser)
+    args = parser.parse_args()
+
+    messages = [{"role": "user", "content": [{"text": args.text}]}]
+    cache = LLMCache(args.cache) if args.cache else None
+
+    async def run():
+        async with AsyncLLMClient(url=args.url, concurrency=args.concurrency, cache=cache,
+                                  **rate_options(args)) as client:
+            start = time.perf_counter()
+            results = await client.query_many([messages] * args.n, return_exceptions=True, max_tokens=16)
+            elapsed = time.perf_counter() - start
+        failures = sum(isinstance(result, Exception) for result in results)
+        print(f"{args.n} requests in {elapsed:.2f}s ({args.n / elapsed:.1f} req/s), "
+              f"{client.retried} retries, {failures} failed")
+        print(json.dumps(client.metrics(), indent=2))
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+import time
+import asyncio
+from collections import deque
+
+
+class FixedLimiter:
+    """At most `limit` requests in flight; same interface as AIMDLimiter."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.in_flight = 0
+        self.semaphore = asyncio.Semaphore(limit)
+
+    async def __aenter__(self):
+        await self.semaphore.acquire()
+        self.in_flight += 1
+
+    async def __aexit__(self, *exc):
+        self.in_flight -= 1
+        self.semaphore.release()
+
+    def success(self, latency):
+        pass
+
+    def overload(self):
+        pass
+
+
+class AIMDLimiter:
+    """Additive-increase / multiplicative-decrease limit on in-flight requests.
+
+    While latency stays within `latency_factor` times the baseline (a slow
+    moving average of good latencies) the limit grows by about `increase` per
+    round trip of the whole window, as TCP congestion control does. A 429/5xx or
+    a latency spike multiplies it by `decrease`, at most once per baseline
+    latency so one burst of errors does not collapse it to the minimum.
+    """
+
+    def __init__(self, initial=4, minimum=1, maximum=64, increase=1.0, decrease=0.5, latency_factor=2.0):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_factor = latency_factor
+
+        self.in_flight = 0
+        self.baseline = None
+        self.last_decrease = 0.0
+        self.condition = asyncio.Condition()
+
+    async def __aenter__(self):
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    async def __aexit__(self, *exc):
+        async with self.condition:
+            self.in_flight -= 1
+            self.condition.notify_all()
+
+    def success(self, latency):
+        if self.baseline is None:
+            self.baseline = latency
+        if latency > self.latency_factor * self.baseline:
+            self.backoff()
+            return
+        self.baseline = 0.95 * self.baseline + 0.05 * latency
+        self.limit = min(self.maximum, self.limit + self.increase / self.limit)
+
+    def overload(self):
+        self.backoff()
+
+    def backoff(self):
+        now = time.monotonic()
+        if now - self.last_decrease < (self.baseline or 0.0):
+            return
+        self.last_decrease = now
+        self.limit = max(self.minimum, self.limit * self.decrease)
+
+
+class TokenBucket:
+    """Token bucket refilled at `rate` per second up to `capacity`.
+
+    `acquire` may drive the bucket into debt for an amount above the capacity,
+    and `refund` returns an over-estimate once the real cost is known.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount=1.0):
+        async with self.lock:
+            self.refill()
+            # requests larger than the capacity wait for a full bucket, then go into debt
+            needed = min(amount, self.capacity)
+            if self.tokens < needed:
+                await asyncio.sleep((needed - self.tokens) / self.rate)
+                self.refill()
+            self.tokens -= amount
+
+    def refund(self, amount):
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class ThroughputMeter:
+    """Requests/s and tokens/s over the last `window` seconds."""
+
+    def __init__(self, window=60.0):
+        self.window = window
+        self.started = time.monotonic()
+        self.events = deque()
+        self.requests = 0
+        self.tokens = 0
+
+    def record(self, tokens):
+        now = time.monotonic()
+        self.events.append((now, tokens))
+        self.requests += 1
+        self.tokens += tokens
+
+    def rates(self):
+        now = time.monotonic()
+        while self.events and now - self.events[0][0] > self.window:
+            self.events.popleft()
+        if not self.events:
+            return 0.0, 0.0
+        span = max(min(self.window, now - self.started), 1e-3)
+        return len(self.events) / span, sum(tokens for _, tokens in self.events) / span
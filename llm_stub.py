@@ -0,0 +1,152 @@
+import json
+import time
+import random
+import asyncio
+import argparse
+from http import HTTPStatus
+
+
+class StubServer:
+    """Local stand-in for the OpenAI-compatible /v1/chat/completions endpoint.
+
+    Answers every request with `reply` (or echoes the last user text) after
+    `latency` seconds, and fails a `fail_rate` fraction of requests with 429 or
+    503, so clients can be exercised without the shared Qwen server.
+
+    Requests with "stream": true get server-sent chunks, one word every
+    `token_delay` seconds, followed by `run_on` filler words that a client
+    stopping early never has to wait for.
+    """
+
+    def __init__(self, reply=None, latency=0.05, fail_rate=0.0, seed=0, token_delay=0.01, run_on=0):
+        self.reply = reply
+        self.token_delay = token_delay
+        self.run_on = run_on
+        self.latency = latency
+        self.fail_rate = fail_rate
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.failures = 0
+        self.streamed_words = 0
+
+    def reply_text(self, payload):
+        if self.reply is not None:
+            return self.reply
+        last = payload["messages"][-1]["content"]
+        return " ".join(part.get("text", "") for part in last) if isinstance(last, list) else last
+
+    def completion(self, payload):
+        text = self.reply_text(payload)
+        return {
+            "id": f"stub-{self.requests}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": payload.get("model", "stub"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 0, "completion_tokens": len(text.split()), "total_tokens": len(text.split())},
+        }
+
+    async def route(self, method, path, body):
+        if method != "POST" or path != "/v1/chat/completions":
+            return HTTPStatus.NOT_FOUND, {"error": f"no route for {method} {path}"}
+        self.requests += 1
+        await asyncio.sleep(self.latency)
+        if self.random.random() < self.fail_rate:
+            self.failures += 1
+            status = self.random.choice([HTTPStatus.TOO_MANY_REQUESTS, HTTPStatus.SERVICE_UNAVAILABLE])
+            return status, {"error": "stub failure"}
+        payload = json.loads(body)
+        if payload.get("stream"):
+            return HTTPStatus.OK, self.chunks(payload)
+        return HTTPStatus.OK, self.completion(payload)
+
+    async def chunks(self, payload):
+        words = self.reply_text(payload).split(" ") + ["filler"] * self.run_on
+        for i, word in enumerate(words):
+            delta = {"content": word if i == 0 else " " + word}
+            if i == 0:
+                delta["role"] = "assistant"
+            yield {"id": f"stub-{self.requests}", "object": "chat.completion.chunk",
+                   "choices": [{"index": 0, "delta": delta, "finish_reason": None}]}
+            self.streamed_words += 1
+            await asyncio.sleep(self.token_delay)
+        yield {"id": f"stub-{self.requests}", "object": "chat.completion.chunk",
+               "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+
+    async def write_stream(self, writer, status, chunks):
+        writer.write(
+            f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+            f"Content-Type: text/event-stream\r\n"
+            f"Connection: close\r\n\r\n".encode()
+        )
+        try:
+            async for chunk in chunks:
+                writer.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                await writer.drain()
+            writer.write(b"data: [DONE]\n\n")
+            await writer.drain()
+        except ConnectionError:
+            # the client stopped reading early
+            pass
+
+    async def handle(self, reader, writer):
+        # keep-alive: serve requests on this connection until the client closes it
+        while True:
+            try:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+            except (ConnectionError, asyncio.IncompleteReadError):
+                break
+            try:
+                status, payload = await self.route(method, path, body)
+            except (ValueError, KeyError) as e:
+                status, payload = HTTPStatus.BAD_REQUEST, {"error": str(e)}
+
+            if not isinstance(payload, dict):
+                await self.write_stream(writer, status, payload)
+                break
+
+            data = json.dumps(payload).encode()
+            writer.write(
+                f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+                f"Content-Type: application/json\r\n"
+                f"Content-Length: {len(data)}\r\n\r\n".encode() + data
+            )
+            await writer.drain()
+        writer.close()
+
+    async def serve(self, host="127.0.0.1", port=6008):
+        server = await asyncio.start_server(self.handle, host, port)
+        print(f"Stub chat completions on http://{host}:{port}/v1/chat/completions")
+        async with server:
+            await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stub OpenAI-compatible chat completions server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6008)
+    parser.add_argument("--reply", default=None, help="fixed reply text (default: echo the last message)")
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds before every response")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="fraction of requests answered with 429/503")
+    parser.add_argument("--token-delay", type=float, default=0.01, help="seconds between streamed words")
+    parser.add_argument("--run-on", type=int, default=0, help="filler words streamed after the reply")
+    args = parser.parse_args()
+
+    server = StubServer(args.reply, args.latency, args.fail_rate, token_delay=args.token_delay,
+                        run_on=args.run_on)
+    asyncio.run(server.serve(args.host, args.port))
+
+
+if __name__ == "__main__":
+    main()
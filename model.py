@@ -1,8 +1,9 @@
 import math
+import argparse
+from pathlib import Path
 from inspect import isfunction
 from functools import partial
 
-import matplotlib.pyplot as plt
 from tqdm.auto import tqdm
 from einops import rearrange
 
@@ -11,7 +12,13 @@ from torch import nn, einsum
 import torch.nn.functional as F
 
 import numpy as np
-from torchvision.transforms import Compose, ToTensor, Lambda, ToPILImage, CenterCrop, Resize
+
+import autoencoder
+from trajectory_writer import TrajectoryWriter
+
+# importing this module only defines the Unet, the schedules and the samplers; training and
+# sampling live behind the CLI in main(), and matplotlib / torchvision / the datasets are
+# imported inside the functions that need them
 
 
 
@@ -377,11 +384,6 @@ def q_sample(x_start, t, noise=None):
 
 
 
-import matplotlib.pyplot as plt
-
-# use seed for reproducability
-torch.manual_seed(0)
-
 def p_losses(denoise_model, x_start, t, noise=None, loss_type="l1"):
     if noise is None:
         noise = torch.randn_like(x_start)
@@ -406,46 +408,46 @@ def p_losses(denoise_model, x_start, t, noise=None, loss_type="l1"):
 
 
 
-# define  dataset + dataloader
-
-
-
-from datasets import load_dataset
-import dataset
-# load dataset from the hub
+# defaults for the CLI
 
 image_size = 28
 channels = 3
 batch_size = 128
+unet_dim = 28
+dim_mults = (1, 2, 4,)
+epochs = 5
 
-from torchvision import transforms
-from torch.utils.data import DataLoader
-
-# define image transformation
-transform = Compose([
-    transforms.RandomHorizontalFlip(),
-    transforms.ToTensor(),
-    transforms.Lambda(lambda t: (t * 2) - 1)
-])
-
-# # define function
-# def transforms(examples):
-#     examples["pixel_values"] = [transform(image.convert("L")) for image in examples["image"]]
-#     del examples["image"]
-
-#     return examples
-
-# transformed_dataset = dataset.with_transform(transforms).remove_columns("label")
 image_dir = '/home/kun/Desktop/DDPM/'
+# latent mode: diffuse the pre-encoded FFHQ latents written by `python autoencoder.py`
+# instead of pixels, and decode only the final samples
+latent_dir = './latents'
 
-data_test = dataset.Ffhq(img_dir=image_dir, transform=transform)
+results_folder = Path("./results")
+save_and_sample_every = 1000
 
+# progressive-resolution curriculum: (resolution, optimizer steps) stages over cached
+# downsampled FFHQ, all training the same fully-convolutional Unet weights. Stage lengths
+# are counted in steps, not epochs: the low-res stages use larger batches and would
+# otherwise get the fewest steps. 60% / 30% / 10% of the steps run at 32 / 64 / 128px.
+curriculum_stages = [(32, 6000), (64, 3000), (128, 1000)]
+curriculum_cache_dir = './ffhq_cache'
+# the batch size grows as the pixel count shrinks, keeping the per-step memory budget
+base_resolution = 128
+base_batch_size = 16
+max_batch_size = 256
 
-# create dataloader
-dataloader = DataLoader(data_test, batch_size=batch_size, shuffle=False)
+# stream every n-th denoising step of the final samples to diffusion.gif
+animation_stride = 2
 
-# batch = next(iter(dataloader))
-# print(batch.keys())
+
+# define image transformation
+def build_transform():
+    from torchvision import transforms
+    return transforms.Compose([
+        transforms.RandomHorizontalFlip(),
+        transforms.ToTensor(),
+        transforms.Lambda(lambda t: (t * 2) - 1)
+    ])
 
 
 
@@ -472,112 +474,321 @@ def p_sample(model, x, t, t_index):
         # Algorithm 2 line 4:
         return model_mean + torch.sqrt(posterior_variance_t) * noise
     
-# Algorithm 2 but save all images:
+# Algorithm 2, yielding x_{t-1} after every step so callers can stream the trajectory
 @torch.no_grad()
-def p_sample_loop(model, shape):
+def p_sample_progressive(model, shape, img=None, start_t=timesteps):
     device = next(model.parameters()).device
 
     b = shape[0]
-    # start from pure noise (for each example in the batch)
-    img = torch.randn(shape, device=device)
-    imgs = []
+    # start from pure noise (for each example in the batch), or from a partially noised x_{start_t}
+    img = torch.randn(shape, device=device) if img is None else img.to(device)
 
-    for i in tqdm(reversed(range(0, timesteps)), desc='sampling loop time step', total=timesteps):
+    for i in tqdm(reversed(range(0, start_t)), desc='sampling loop time step', total=start_t):
         img = p_sample(model, img, torch.full((b,), i, device=device, dtype=torch.long), i)
-        imgs.append(img.cpu().numpy())
-    return imgs
+        yield img
 
+# Algorithm 2 but save all images:
 @torch.no_grad()
-def sample(model, image_size, batch_size=16, channels=3):
-    return p_sample_loop(model, shape=(batch_size, channels, image_size, image_size))
-
+def p_sample_loop(model, shape, img=None, start_t=timesteps):
+    return [img.cpu().numpy() for img in p_sample_progressive(model, shape, img=img, start_t=start_t)]
 
+# DDIM (Song et al.): deterministic for eta=0, runs on a strided subset of the timesteps
+@torch.no_grad()
+def ddim_sample_progressive(model, shape, img=None, start_t=timesteps, ddim_steps=50, eta=0.0):
+    device = next(model.parameters()).device
 
+    b = shape[0]
+    img = torch.randn(shape, device=device) if img is None else img.to(device)
+
+    steps = torch.linspace(0, start_t - 1, min(ddim_steps, start_t)).round().long().unique().flip(0).tolist()
+    for i, step in enumerate(tqdm(steps, desc='ddim sampling loop time step')):
+        t = torch.full((b,), step, device=device, dtype=torch.long)
+        alpha_t = extract(alphas_cumprod, t, img.shape)
+        if i + 1 < len(steps):
+            alpha_prev = extract(alphas_cumprod, torch.full_like(t, steps[i + 1]), img.shape)
+        else:
+            alpha_prev = torch.ones_like(alpha_t)
 
+        predicted_noise = model(img, t)
+        x_start = (img - torch.sqrt(1. - alpha_t) * predicted_noise) / torch.sqrt(alpha_t)
 
-# train the model
+        sigma = eta * torch.sqrt((1. - alpha_prev) / (1. - alpha_t) * (1. - alpha_t / alpha_prev))
+        img = torch.sqrt(alpha_prev) * x_start + torch.sqrt(1. - alpha_prev - sigma ** 2) * predicted_noise
+        if eta > 0:
+            img = img + sigma * torch.randn_like(img)
+        yield img
 
-from pathlib import Path
-def num_to_groups(num, divisor):
-    groups = num // divisor
-    remainder = num % divisor
-    arr = [divisor] * groups
-    if remainder > 0:
-        arr.append(remainder)
-    return arr
+@torch.no_grad()
+def ddim_sample_loop(model, shape, img=None, start_t=timesteps, ddim_steps=50, eta=0.0):
+    steps = ddim_sample_progressive(model, shape, img=img, start_t=start_t, ddim_steps=ddim_steps, eta=eta)
+    return [img.cpu().numpy() for img in steps]
 
-results_folder = Path("./results")
-results_folder.mkdir(exist_ok=True)
-save_and_sample_every = 1000
+samplers = {"ddpm": p_sample_loop, "ddim": ddim_sample_loop}
+progressive_samplers = {"ddpm": p_sample_progressive, "ddim": ddim_sample_progressive}
 
-from torch.optim import Adam
+@torch.no_grad()
+def sample(model, image_size, batch_size=16, channels=3):
+    return p_sample_loop(model, shape=(batch_size, channels, image_size, image_size))
 
-device = "cuda" if torch.cuda.is_available() else "cpu"
+# SDEdit-style img2img: noise x_start to t = strength * T with q_sample and run only the
+# remaining reverse steps, so an edit costs `strength` of a full generation
+@torch.no_grad()
+def img2img(model, x_start, strength=0.5, sampler="ddpm", noise=None, **sampler_kwargs):
+    device = next(model.parameters()).device
+    x_start = x_start.to(device)
 
-model = Unet(
-    dim=image_size,
-    channels=channels,
-    dim_mults=(1, 2, 4,)
-)
-model.to(device)
+    start_t = min(timesteps, max(1, int(round(strength * timesteps))))
+    t = torch.full((x_start.shape[0],), start_t - 1, device=device, dtype=torch.long)
+    img = q_sample(x_start, t, noise=noise)
+    return samplers[sampler](model, x_start.shape, img=img, start_t=start_t, **sampler_kwargs)
 
-optimizer = Adam(model.parameters(), lr=1e-3)
+# latents -> images in [-1, 1]; without a decoder (pixel mode) samples pass through unchanged
+def decode(samples, decoder=None, scale_factor=1.0):
+    if decoder is None:
+        return samples
+    return autoencoder.decode_latents(decoder, samples, scale_factor)
 
-from torchvision.utils import save_image
+# images in [-1, 1] -> whatever space the Unet diffuses in
+@torch.no_grad()
+def encode(images, decoder=None, scale_factor=1.0):
+    if decoder is None:
+        return images
+    device = next(decoder.parameters()).device
+    return decoder.encode(images.to(device)) * scale_factor
 
-epochs = 5
+def load_images(paths, image_size):
+    from PIL import Image
+    from torchvision.transforms import Compose, ToTensor, Lambda, CenterCrop, Resize
+    load = Compose([
+        Resize(image_size),
+        CenterCrop(image_size),
+        ToTensor(),
+        Lambda(lambda t: (t * 2) - 1),
+    ])
+    return torch.stack([load(Image.open(path).convert("RGB")) for path in paths])
 
-for epoch in range(epochs):
-    for step, batch in enumerate(dataloader):
-        optimizer.zero_grad()
+def save_images(images, path, nrow=8):
+    from torchvision.utils import save_image
+    save_image((torch.as_tensor(images) + 1) * 0.5, str(path), nrow=nrow)
 
-        batch_size = batch.shape[0]
-        batch = batch.to(device)
 
-        # Algorithm 1 line 3: sample t uniformally for every example in the batch
-        t = torch.randint(0, timesteps, (batch_size,), device=device).long()
 
-        loss = p_losses(model, batch, t, loss_type="huber")
 
-        if step % 100 == 0:
-            print("Loss:", loss.item())
-        
-        loss.backward()
-        optimizer.step()
-
-        # save generated images
-        if step != 0 and step % save_and_sample_every == 0:
-            milestone = step // save_and_sample_every
-            batches = num_to_groups(4, batch_size)
-            all_images_list = list(map(lambda n: sample(model, batch_siz=n, channels=channels), batches))
-            all_images = torch.cat(all_images_list, dim=0)
-            all_images = (all_images + 1) * 0.5
-            save_image(all_images,str(results_folder / f'sample-{milestone}.png'), nrow = 6)
-            
 
+# train the model
 
-# sampling
-# sample 64 images
-samples = sample(model, image_size=image_size, batch_size=64, channels=channels)
+def num_to_groups(num, divisor):
+    groups = num // divisor
+    remainder = num % divisor
+    arr = [divisor] * groups
+    if remainder > 0:
+        arr.append(remainder)
+    return arr
 
-#show a random one
-random_index = 5
-plt.imshow(samples[-1][random_index].reshape(image_size, image_size, channels), cmap="gray")
+def stage_batch_size(resolution):
+    return min(max_batch_size, max(1, base_batch_size * (base_resolution // resolution) ** 2))
 
-import matplotlib.animation as animation
+def train(model, dataloader, optimizer, epochs, image_size, channels=3, decoder=None, scale_factor=1.0,
+          sample_prefix="sample", results_folder=results_folder, max_steps=None):
+    device = next(model.parameters()).device
+    done = 0
+    for epoch in range(epochs):
+        for step, batch in enumerate(dataloader):
+            if max_steps is not None and done >= max_steps:
+                return
+            done += 1
+            optimizer.zero_grad()
 
-random_index = 53
-fig = plt.figure()
-ims = []
-for i in range(timesteps):
-     im = plt.imshow(samples[i][random_index].reshape(image_size, image_size, channels), cmap="gray", animated = True)
-     ims.append([im])
+            batch_size = batch.shape[0]
+            batch = batch.to(device)
 
-animate = animation.ArtistAnimation(fig, ims, interval=50, blit=True, repeat_delay=1000)
-animate.save('diffusion.gif')
-plt.show()
+            # Algorithm 1 line 3: sample t uniformally for every example in the batch
+            t = torch.randint(0, timesteps, (batch_size,), device=device).long()
 
+            loss = p_losses(model, batch, t, loss_type="huber")
 
+            if step % 100 == 0:
+                print("Loss:", loss.item())
+            
+            loss.backward()
+            optimizer.step()
+
+            # save generated images
+            if step != 0 and step % save_and_sample_every == 0:
+                milestone = step // save_and_sample_every
+                batches = num_to_groups(4, batch_size)
+                all_images_list = list(map(lambda n: decode(sample(model, image_size=image_size, batch_size=n, channels=channels)[-1], decoder, scale_factor), batches))
+                save_images(np.concatenate(all_images_list, axis=0), results_folder / f'{sample_prefix}-{milestone}.png', nrow = 6)
+
+# weights plus the few hyperparameters needed to rebuild the Unet elsewhere (e.g. sample_server.py)
+def save_checkpoint(model, path, **config):
+    torch.save({"model": model.state_dict(), "config": config}, path)
+
+def load_checkpoint(path, device="cpu"):
+    checkpoint = torch.load(path, map_location=device)
+    config = checkpoint["config"]
+    model = Unet(dim=config["dim"], channels=config["channels"], dim_mults=tuple(config["dim_mults"]))
+    model.load_state_dict(checkpoint["model"])
+    return model.to(device).eval(), config
+
+# the autoencoder of a latent-mode checkpoint, or (None, 1.0) for pixel space
+def load_decoder(config, device="cpu"):
+    if not config.get("latent_dir"):
+        return None, 1.0
+    decoder = autoencoder.load_autoencoder(config["latent_dir"], device=device)
+    return decoder, autoencoder.load_latent_meta(config["latent_dir"])["scale_factor"]
+
+
+def generate(model, config, decoder=None, scale_factor=1.0, n=64, sampler="ddpm", animation='diffusion.gif',
+             stride=animation_stride, **sampler_kwargs):
+    shape = (n, config["channels"], config["image_size"], config["image_size"])
+    steps = progressive_samplers[sampler](model, shape, **sampler_kwargs)
+    if not animation:
+        for img in steps:
+            pass
+        return decode(img.cpu().numpy(), decoder, scale_factor)
+
+    # stream every `stride`-th step of all samples into one grid animation
+    writer = TrajectoryWriter(animation, stride=stride, nrow=int(math.ceil(math.sqrt(n))), fps=20,
+                              transform=lambda step: decode(step, decoder, scale_factor))
+    with writer:
+        for img in steps:
+            writer.append(img)
+    return decode(img.cpu().numpy(), decoder, scale_factor)
+
+
+def train_command(args):
+    import dataset
+    from torch.optim import Adam
+    from torch.utils.data import DataLoader
+
+    # use seed for reproducability
+    torch.manual_seed(0)
+
+    results = Path(args.results_dir)
+    results.mkdir(exist_ok=True)
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+
+    size, chans = args.image_size, channels
+    config_latent_dir = None
+    decoder, scale_factor = None, 1.0
+    if args.latent:
+        latent_meta = autoencoder.load_latent_meta(args.latent_dir)
+        _, chans, size, _ = latent_meta["shape"]
+        config_latent_dir = args.latent_dir
+        decoder, scale_factor = load_decoder({"latent_dir": args.latent_dir}, device=device)
+        data_test = dataset.FfhqLatents(args.latent_dir)
+    else:
+        data_test = dataset.Ffhq(img_dir=args.image_dir, transform=build_transform())
 
-# sampling
-import cv2
+    model = Unet(
+        dim=unet_dim,
+        channels=chans,
+        dim_mults=dim_mults
+    )
+    model.to(device)
+
+    optimizer = Adam(model.parameters(), lr=1e-3)
+
+    if args.curriculum:
+        assert not args.latent, "the resolution curriculum trains in pixel space"
+        for resolution, stage_steps in curriculum_stages:
+            cache_path = dataset.build_resolution_cache(args.image_dir, curriculum_cache_dir, resolution)
+            stage_data = dataset.FfhqCache(cache_path, transform=build_transform())
+            stage_loader = DataLoader(stage_data, batch_size=stage_batch_size(resolution), shuffle=True)
+            stage_epochs = math.ceil(stage_steps / len(stage_loader))
+            print(f"Curriculum stage: {resolution}x{resolution}, batch size {stage_loader.batch_size}, "
+                  f"{stage_steps} steps ({stage_epochs} epochs)")
+            train(model, stage_loader, optimizer, stage_epochs, resolution, chans,
+                  sample_prefix=f"sample-{resolution}", results_folder=results, max_steps=stage_steps)
+        size = curriculum_stages[-1][0]
+    else:
+        # create dataloader
+        dataloader = DataLoader(data_test, batch_size=args.batch_size, shuffle=False)
+        train(model, dataloader, optimizer, args.epochs, size, chans, decoder, scale_factor, results_folder=results)
+
+    config = dict(dim=unet_dim, channels=chans, dim_mults=dim_mults, image_size=size, latent_dir=config_latent_dir)
+    save_checkpoint(model, results / 'model.pt', **config)
+    model.eval()
+
+    # sampling
+    # sample 64 images
+    images = generate(model, config, decoder, scale_factor, n=64, animation=args.animation)
+    save_images(images, results / 'samples.png')
+
+
+def sample_command(args):
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    model, config = load_checkpoint(args.checkpoint, device=device)
+    decoder, scale_factor = load_decoder(config, device=device)
+
+    sampler_kwargs = {"ddim_steps": args.ddim_steps} if args.sampler == "ddim" else {}
+    images = generate(model, config, decoder, scale_factor, n=args.n, sampler=args.sampler,
+                      animation=args.animation, stride=args.animation_stride, **sampler_kwargs)
+    save_images(images, args.output)
+
+    if args.show:
+        import matplotlib.pyplot as plt
+        #show a random one
+        random_index = 0
+        plt.imshow(((images[random_index].transpose(1, 2, 0) + 1) * 0.5).clip(0, 1))
+        plt.show()
+
+
+# img2img: edit existing faces instead of generating from pure noise
+def img2img_command(args):
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    model, config = load_checkpoint(args.checkpoint, device=device)
+    decoder, scale_factor = load_decoder(config, device=device)
+
+    pixel_size = config["image_size"] * (decoder.downsample_factor if decoder is not None else 1)
+    x_start = encode(load_images(args.images, pixel_size), decoder, scale_factor)
+    sampler_kwargs = {"ddim_steps": args.ddim_steps} if args.sampler == "ddim" else {}
+    edited = img2img(model, x_start, strength=args.strength, sampler=args.sampler, **sampler_kwargs)[-1]
+    save_images(decode(edited, decoder, scale_factor), args.output, nrow = 4)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="DDPM on FFHQ: train, sample and edit.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    train_parser = subparsers.add_parser("train", help="train a Unet, save results/model.pt and sample from it")
+    train_parser.add_argument("--image-dir", default=image_dir)
+    train_parser.add_argument("--image-size", type=int, default=image_size)
+    train_parser.add_argument("--batch-size", type=int, default=batch_size)
+    train_parser.add_argument("--epochs", type=int, default=epochs)
+    train_parser.add_argument("--latent", action="store_true", help="train on the latent store in --latent-dir")
+    train_parser.add_argument("--latent-dir", default=latent_dir)
+    curriculum_steps = sum(steps for _, steps in curriculum_stages)
+    train_parser.add_argument("--curriculum", action="store_true", help="train through curriculum_stages: " + ", ".join(
+        f"{steps} steps ({100 * steps // curriculum_steps}%%) at {resolution}px" for resolution, steps in curriculum_stages))
+    train_parser.add_argument("--results-dir", default=str(results_folder))
+    train_parser.add_argument("--animation", default="diffusion.gif")
+    train_parser.set_defaults(func=train_command)
+
+    sample_parser = subparsers.add_parser("sample", help="sample from a saved checkpoint")
+    sample_parser.add_argument("--checkpoint", default=str(results_folder / "model.pt"))
+    sample_parser.add_argument("--n", type=int, default=64)
+    sample_parser.add_argument("--sampler", default="ddpm", choices=sorted(samplers))
+    sample_parser.add_argument("--ddim-steps", type=int, default=50)
+    sample_parser.add_argument("--output", default=str(results_folder / "samples.png"))
+    sample_parser.add_argument("--animation", default="diffusion.gif", help="empty string to skip")
+    sample_parser.add_argument("--animation-stride", type=int, default=animation_stride)
+    sample_parser.add_argument("--show", action="store_true", help="display one sample with matplotlib")
+    sample_parser.set_defaults(func=sample_command)
+
+    edit_parser = subparsers.add_parser("img2img", help="SDEdit existing images with a saved checkpoint")
+    edit_parser.add_argument("images", nargs="+")
+    edit_parser.add_argument("--checkpoint", default=str(results_folder / "model.pt"))
+    edit_parser.add_argument("--strength", type=float, default=0.5)
+    edit_parser.add_argument("--sampler", default="ddim", choices=sorted(samplers))
+    edit_parser.add_argument("--ddim-steps", type=int, default=50)
+    edit_parser.add_argument("--output", default=str(results_folder / "edited.png"))
+    edit_parser.set_defaults(func=img2img_command)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
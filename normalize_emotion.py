@@ -41,17 +41,6 @@ def normalize_emotions(data):
     
     return data
 
-# 读取JSON文件
-with open('process/gemini_restructured_results.json', 'r') as f:
-    data = json.load(f)
-
-# 规范化情绪值
-normalized_data = normalize_emotions(data)
-
-# 保存更新后的JSON文件
-with open('process/gemini_normalized_results.json', 'w') as f:
-    json.dump(normalized_data, f, indent=4)
-
 # 验证更新后的结果
 def verify_emotions(data):
     valid_emotions = {'amusement', 'excitement', 'contentment', 'awe', 
@@ -65,6 +54,18 @@ def verify_emotions(data):
     
     return invalid_emotions
 
-# 检查是否还有非目标情绪词
-remaining_invalid = verify_emotions(normalized_data)
-print("Remaining invalid emotions:", remaining_invalid if remaining_invalid else "None")
+if __name__ == '__main__':
+    # 读取JSON文件
+    with open('process/gemini_restructured_results.json', 'r') as f:
+        data = json.load(f)
+
+    # 规范化情绪值
+    normalized_data = normalize_emotions(data)
+
+    # 保存更新后的JSON文件
+    with open('process/gemini_normalized_results.json', 'w') as f:
+        json.dump(normalized_data, f, indent=4)
+
+    # 检查是否还有非目标情绪词
+    remaining_invalid = verify_emotions(normalized_data)
+    print("Remaining invalid emotions:", remaining_invalid if remaining_invalid else "None")
@@ -0,0 +1,184 @@
+import os
+import json
+import argparse
+from collections import Counter, defaultdict
+
+from check_values import normalize_cell
+from split_result import ASPECT_FILENAME_MAP, IDENTITY_FILENAME_MAP
+
+
+def iter_jsonl(path):
+    # annotate.py output: failed and torn lines are skipped, as completed_images() does
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if record.get("error") is None and "image" in record:
+                yield record["image"], record.get("result")
+
+
+def iter_json(path):
+    try:
+        import ijson
+    except ImportError:
+        # without ijson the whole object has to be loaded first
+        with open(path, 'r', encoding='utf-8') as f:
+            yield from json.load(f).items()
+        return
+    with open(path, 'rb') as f:
+        yield from ijson.kvitems(f, '')
+
+
+def iter_results(path):
+    """(image, {identity: {aspect: value}}) pairs of a results file, read incrementally.
+
+    Accepts the JSONL written by annotate.py and the {image: {...}} JSON of the
+    restructured/normalized results; the latter is streamed with ijson when it
+    is installed.
+    """
+    if path.endswith('.jsonl'):
+        return iter_jsonl(path)
+    return iter_json(path)
+
+
+class JsonObjectWriter:
+    """Writes a flat JSON object one entry at a time, in the same layout as json.dump(..., indent=2).
+
+    The file is written next to its destination and moved into place on close,
+    so an interrupted run never leaves a truncated split file behind.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.tmp_path = f"{path}.{os.getpid()}.tmp"
+        self.file = open(self.tmp_path, 'w')
+        self.count = 0
+
+    def add(self, key, value):
+        self.file.write(("{\n" if self.count == 0 else ",\n") + f"  {json.dumps(key)}: {json.dumps(value)}")
+        self.count += 1
+
+    def close(self):
+        self.file.write("\n}" if self.count else "{}")
+        self.file.close()
+        os.replace(self.tmp_path, self.path)
+
+
+class PostProcessor:
+    """normalize_emotion.py, check_values.py and split_result.py in one pass over the results.
+
+    Every image is handled as soon as it is read: each identity/aspect cell goes
+    through check_values.normalize_cell (emotions mapped with `emotion_mapping`,
+    then validated against `valid_values`), and valid cells are appended to the
+    39 split files. Missing and invalid cells, including non-string values, are
+    appended to `missing.jsonl`; only per-cell counters and a few example images
+    stay in memory, whatever the size of the input.
+    """
+
+    def __init__(self, output_dir, normalized_path=None, examples=10):
+        self.output_dir = output_dir
+        self.normalized_path = normalized_path
+        self.examples = examples
+
+        self.images = 0
+        self.written = Counter()
+        self.missing = Counter()
+        self.missing_examples = defaultdict(list)
+        self.invalid = {aspect: Counter() for aspect in ASPECT_FILENAME_MAP}
+
+    def open(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+        self.writers = {
+            (identity, aspect): JsonObjectWriter(
+                os.path.join(self.output_dir, f"{aspect_filename}_{identity_filename}.json"))
+            for identity, identity_filename in IDENTITY_FILENAME_MAP.items()
+            for aspect, aspect_filename in ASPECT_FILENAME_MAP.items()
+        }
+        self.missing_file = open(os.path.join(self.output_dir, "missing.jsonl"), 'w', encoding='utf-8')
+        self.normalized_file = open(self.normalized_path, 'w', encoding='utf-8') if self.normalized_path else None
+
+    def close(self):
+        for writer in self.writers.values():
+            writer.close()
+        self.missing_file.close()
+        if self.normalized_file is not None:
+            self.normalized_file.close()
+
+    def record_missing(self, image_name, identity, aspect, value=None):
+        self.missing[identity, aspect] += 1
+        if len(self.missing_examples[identity, aspect]) < self.examples:
+            self.missing_examples[identity, aspect].append(image_name)
+        entry = {"image": image_name, "identity": identity, "aspect": aspect,
+                 "reason": "missing" if value is None else "invalid", "value": value}
+        self.missing_file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    def process(self, image, analysis):
+        image_name = image.replace('.jpg', '')
+        self.images += 1
+        normalized = {}
+
+        for identity in IDENTITY_FILENAME_MAP:
+            group = analysis.get(identity) if isinstance(analysis, dict) else None
+            for aspect in ASPECT_FILENAME_MAP:
+                value = group.get(aspect) if isinstance(group, dict) else None
+                if value is None:
+                    self.record_missing(image_name, identity, aspect)
+                    continue
+                value, valid = normalize_cell(aspect, value)
+                if not valid:
+                    # lists and objects are counted by their JSON text
+                    self.invalid[aspect][value if isinstance(value, str) else json.dumps(value)] += 1
+                    self.record_missing(image_name, identity, aspect, value)
+                    continue
+                self.writers[identity, aspect].add(image_name, f"{value};")
+                self.written[identity, aspect] += 1
+                normalized.setdefault(identity, {})[aspect] = value
+
+        if self.normalized_file is not None:
+            self.normalized_file.write(json.dumps({"image": image, "result": normalized}, ensure_ascii=False) + "\n")
+
+    def run(self, results_path):
+        self.open()
+        try:
+            for image, analysis in iter_results(results_path):
+                self.process(image, analysis)
+        finally:
+            self.close()
+
+    def report(self):
+        print(f"Processed {self.images} images")
+        print("Invalid values found:")
+        for aspect, values in self.invalid.items():
+            print(f"{aspect.capitalize()}:", dict(values) if values else "None")
+
+        for (identity, aspect), count in self.missing.items():
+            examples = self.missing_examples[identity, aspect]
+            print(f"\nMissing images for {identity} - {aspect}:")
+            print(f"Total missing: {count}")
+            print("Missing images:", examples, "..." if count > len(examples) else "")
+
+        print()
+        for identity, identity_filename in IDENTITY_FILENAME_MAP.items():
+            for aspect, aspect_filename in ASPECT_FILENAME_MAP.items():
+                print(f"Created: {aspect_filename}_{identity_filename}.json "
+                      f"with {self.written[identity, aspect]} entries")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Normalize, validate and split annotation results in one streaming pass.")
+    parser.add_argument("results", help="annotate.py JSONL or {image: {identity: {aspect: value}}} JSON")
+    parser.add_argument("output_dir", help="directory for the split files and missing.jsonl")
+    parser.add_argument("--normalized", default=None,
+                        help="also write the mapped, valid cells of every image to this JSONL file")
+    args = parser.parse_args()
+
+    processor = PostProcessor(args.output_dir, args.normalized)
+    processor.run(args.results)
+    processor.report()
+
+
+if __name__ == "__main__":
+    main()
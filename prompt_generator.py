@@ -0,0 +1,232 @@
+import os
+import re
+import json
+import time
+import asyncio
+import argparse
+
+from gpt import QWEN_URL, QWEN_MODEL, prompt_messages
+from llm_cache import LLMCache
+from llm_client import AsyncLLMClient, add_rate_arguments, rate_options
+
+SEPARATOR = "->"
+
+
+def normalize_rule(rule):
+    # "A -> B->C " and "A->B->C" are the same rule
+    return SEPARATOR.join(" ".join(level.split()) for level in rule.split(SEPARATOR) if level.strip())
+
+
+def load_rules(path):
+    """Rules from a prompt JSON ({rule: {...}}, e.g. sd3.5/output.json) or a text file with one rule per line."""
+    with open(path, 'r', encoding='utf-8') as f:
+        if path.endswith('.json'):
+            return list(json.load(f))
+        return [line.strip() for line in f if line.strip()]
+
+
+class RuleTree:
+    """Violation rules ("A->B->...->F") as a tree of their levels.
+
+    Identical rules (after whitespace normalization) collapse into one leaf, and
+    walking the tree depth-first yields rules grouped by their longest shared
+    prefix. Requests are sent in that order, so the endpoint's prefix cache can
+    reuse the shared part of consecutive prompts.
+    """
+
+    def __init__(self, rules=()):
+        self.root = {}
+        self.leaves = 0
+        self.duplicates = 0
+        for rule in rules:
+            self.add(rule)
+
+    def add(self, rule):
+        node = self.root
+        for level in normalize_rule(rule).split(SEPARATOR):
+            node = node.setdefault(level, {})
+        if None in node:
+            self.duplicates += 1
+        else:
+            node[None] = True
+            self.leaves += 1
+
+    def rules(self):
+        stack = [((), self.root)]
+        while stack:
+            path, node = stack.pop()
+            if None in node:
+                yield SEPARATOR.join(path)
+            children = [(level, child) for level, child in node.items() if level is not None]
+            for level, child in reversed(children):
+                stack.append((path + (level,), child))
+
+    def nodes(self):
+        count, stack = 0, [self.root]
+        while stack:
+            node = stack.pop()
+            children = [child for level, child in node.items() if level is not None]
+            count += len(children)
+            stack.extend(children)
+        return count
+
+
+# shorter answers are cut-off or refused prompts; they are regenerated
+MIN_PROMPT_WORDS = 3
+
+
+def split_prompt(content):
+    """The prompt paragraph of a (possibly partial) answer, and whether it is finished.
+
+    The task asks for "<prompt>", so answers may wrap the prompt in tags, label it
+    ("**Prompt:**") or open with a preamble paragraph ending in ':'. The first
+    other paragraph is the prompt; it is finished once a blank line or </prompt>
+    follows it, while a trailing paragraph may still be streaming.
+    """
+    text, closed = content, False
+    start = re.search(r"<prompt>", text, flags=re.I)
+    if start:
+        text = text[start.end():]
+    end = re.search(r"</prompt>", text, flags=re.I)
+    if end:
+        text, closed = text[:end.start()], True
+
+    parts = re.split(r"\n\s*\n", text)
+    for i, part in enumerate(parts):
+        paragraph = re.sub(r"^\**\s*prompt\s*\**\s*:\s*\**\s*", "", part.strip(), flags=re.I)
+        paragraph = paragraph.strip().strip('"').strip()
+        if not paragraph or paragraph.endswith(":"):
+            continue
+        return paragraph, closed or i < len(parts) - 1
+    return "", closed
+
+
+def clean_prompt(content):
+    return split_prompt(content)[0]
+
+
+def prompt_complete(content):
+    # streaming stop condition: the prompt paragraph is finished, the rest is run-on
+    paragraph, finished = split_prompt(content)
+    return finished and bool(paragraph)
+
+
+def valid_prompt(prompt):
+    return len(prompt.split()) >= MIN_PROMPT_WORDS
+
+
+class OutputWriter:
+    """Keeps output.json in the format update_sd3.5.py reads ({rule: {"prompt": ...}}), rewritten atomically.
+
+    update_sd3.5.py numbers images by position in the file, so existing keys keep
+    their spelling and position, and new rules are appended in input order with
+    an empty prompt (which update_sd3.5.py skips) until theirs arrives. The file
+    is replaced at most every `interval` seconds, so an interrupted run keeps
+    (and later skips) everything generated so far.
+    """
+
+    def __init__(self, path, existing, rules, interval=5.0):
+        self.path = path
+        self.data = dict(existing)
+        self.keys = {normalize_rule(key): key for key in existing}
+        for rule in rules:
+            if rule not in self.keys:
+                self.keys[rule] = rule
+                self.data[rule] = {"prompt": ""}
+        self.interval = interval
+        self.last_write = 0.0
+
+    def add(self, rule, prompt):
+        self.data[self.keys[rule]] = {"prompt": prompt}
+        if time.monotonic() - self.last_write >= self.interval:
+            self.write()
+
+    def write(self):
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.data, f, indent=4, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+        self.last_write = time.monotonic()
+
+    def has_prompt(self, rule):
+        return valid_prompt(self.data[self.keys[rule]].get("prompt", ""))
+
+
+def load_existing(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+async def generate(client, rules, writer, stream=False, max_tokens=300):
+    options = {"stream": True, "stop_when": prompt_complete} if stream else {}
+    failed = []
+    queue = asyncio.Queue()
+    for rule in rules:
+        queue.put_nowait(rule)
+
+    async def worker():
+        while not queue.empty():
+            rule = queue.get_nowait()
+            try:
+                role, content = await client.query(prompt_messages(rule), max_tokens=max_tokens, **options)
+            except Exception as e:
+                print(f"Failed: {rule}: {e!r}")
+                failed.append(rule)
+                continue
+            prompt = clean_prompt(content)
+            if not valid_prompt(prompt):
+                failed.append(rule)
+                continue
+            writer.add(rule, prompt)
+
+    await asyncio.gather(*(worker() for _ in range(client.max_in_flight)))
+    writer.write()
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate Stable Diffusion prompts for every violation rule.")
+    parser.add_argument("--rules", default="sd3.5/output.json",
+                        help="prompt JSON whose keys are the rules, or a text file with one rule per line")
+    parser.add_argument("--output", default="sd3.5/output.json", help="prompt JSON read by update_sd3.5.py")
+    parser.add_argument("--overwrite", action="store_true", help="regenerate rules that already have a prompt")
+    parser.add_argument("--url", default=QWEN_URL)
+    parser.add_argument("--model", default=QWEN_MODEL)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--max-tokens", type=int, default=300)
+    parser.add_argument("--stream", action="store_true",
+                        help="stop reading each answer once its prompt paragraph is complete")
+    parser.add_argument("--cache", default=None, help="SQLite response cache file")
+    add_rate_arguments(parser)
+    args = parser.parse_args()
+
+    rules = [normalize_rule(rule) for rule in load_rules(args.rules)]
+    tree = RuleTree(rules)
+    writer = OutputWriter(args.output, load_existing(args.output), dict.fromkeys(rules))
+
+    # requests go out in tree order, so rules sharing a prefix are sent back to back
+    order = list(tree.rules())
+    todo = order if args.overwrite else [rule for rule in order if not writer.has_prompt(rule)]
+    print(f"{tree.leaves} distinct rules ({tree.duplicates} duplicates dropped, {tree.nodes()} tree nodes), "
+          f"{len(order) - len(todo)} already have a prompt, {len(todo)} to generate")
+    if not todo:
+        return
+
+    cache = LLMCache(args.cache) if args.cache else None
+
+    async def run():
+        async with AsyncLLMClient(url=args.url, model=args.model, concurrency=args.concurrency, cache=cache,
+                                  **rate_options(args)) as client:
+            start = time.perf_counter()
+            failed = await generate(client, todo, writer, args.stream, args.max_tokens)
+            elapsed = time.perf_counter() - start
+        print(f"{len(todo) - len(failed)} prompts in {elapsed:.1f}s, {len(failed)} failed (rerun to retry)")
+        print(json.dumps(client.metrics(), indent=2))
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
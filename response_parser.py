@@ -0,0 +1,133 @@
+import re
+import json
+
+from check_values import normalize_cell, valid_values
+from split_result import IDENTITY_FILENAME_MAP
+
+IDENTITIES = list(IDENTITY_FILENAME_MAP)
+ASPECTS = list(valid_values)
+
+# how prompt.json introduces each identity group
+IDENTITY_DESCRIPTIONS = {
+    "age_18_to_21": "Age group 18 to 21",
+    "age_22_to_25": "Age group 22 to 25",
+    "age_26_to_29": "Age group 26 to 29",
+    "age_30_to_34": "Age group 30 to 34",
+    "age_35_to_40": "Age group 35 to 40",
+    "JuniorCollege": "Junior College graduates",
+    "JuniorHigh": "Junior High School graduates",
+    "SeniorHigh": "Senior High School graduates",
+    "TechnicalSecondarySchool": "Technical Secondary School graduates",
+    "University": "University graduates",
+    "female": "Female",
+    "male": "Male",
+    "id_free": "no identity: disregard every group attribute and assess objectively",
+}
+
+
+def extract_json(content):
+    # answers come fenced in ```json ... ``` and often copy the template's trailing comma
+    match = re.search(r"\{.*\}", content, re.S)
+    if match is None:
+        return None
+    text = re.sub(r",\s*([}\]])", r"\1", match.group(0))
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        return None
+
+
+def json_object_complete(content):
+    """Whether the first top-level JSON object in a (partial) answer has been closed.
+
+    Used as the streaming stop condition: everything after the object is run-on
+    text the parser ignores anyway.
+    """
+    start = content.find("{")
+    if start < 0:
+        return False
+    depth, in_string, escaped = 0, False, False
+    for char in content[start:]:
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char == "{":
+            depth += 1
+        elif char == "}":
+            depth -= 1
+            if depth == 0:
+                return True
+    return False
+
+
+def validate_group(assessments):
+    """Returns the group's {aspect: value} with normalized values, or raises ValueError.
+
+    Emotions that normalize_emotion.py maps (e.g. hope -> contentment) are mapped
+    before validation, so they do not cost a follow-up request.
+    """
+    if not isinstance(assessments, dict):
+        raise ValueError(f"expected an object, got {type(assessments).__name__}")
+    group = {}
+    for aspect, valid in valid_values.items():
+        value = assessments.get(aspect)
+        if not isinstance(value, str):
+            raise ValueError(f"{aspect} missing")
+        value, ok = normalize_cell(aspect, value.strip().lower())
+        if not ok:
+            raise ValueError(f"{aspect} {value!r} not one of {sorted(valid)}")
+        group[aspect] = value
+    return group
+
+
+def parse_response(content, identities=IDENTITIES):
+    """Splits an answer to the prompt.json task into valid and unusable identity groups.
+
+    Every group is validated on its own, so one malformed group does not discard
+    the others.
+
+    Returns:
+        (dict, dict): {identity: {aspect: value}} of the valid groups, and
+        {identity: reason} for every requested group that is missing or invalid.
+    """
+    data = extract_json(content)
+    if not isinstance(data, dict):
+        return {}, {identity: "no JSON object in the answer" for identity in identities}
+
+    valid, problems = {}, {}
+    for identity in identities:
+        if identity not in data:
+            problems[identity] = "missing"
+            continue
+        try:
+            valid[identity] = validate_group(data[identity])
+        except ValueError as e:
+            problems[identity] = str(e)
+    return valid, problems
+
+
+def followup_task(identities):
+    """A short task asking again for only the given identity groups."""
+    groups = "\n".join(f"- {identity}: {IDENTITY_DESCRIPTIONS[identity]}" for identity in identities)
+    example = ",".join(
+        f'"{identity}":{{"quality":"positive/normal/negative", "aesthetic":"positive/normal/negative", '
+        f'"emotion":"{"/".join(sorted(valid_values["emotion"]))}"}}'
+        for identity in identities
+    )
+    return (
+        "### Task\n"
+        "Assess the provided image for image quality (\"positive\", \"normal\" or \"negative\"), "
+        "aesthetic appeal (\"positive\", \"normal\" or \"negative\") and the emotion it evokes "
+        f"(one of {', '.join(sorted(valid_values['emotion']))}), role-playing each of these groups "
+        "independently:\n"
+        f"{groups}\n\n"
+        "### Response Format\n"
+        "Answer only with this JSON object, using exactly one of the listed values for every field:\n"
+        f"```json\n{{{example}}}\n```"
+    )
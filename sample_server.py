@@ -0,0 +1,228 @@
+import io
+import json
+import base64
+import asyncio
+import argparse
+from collections import deque
+from http import HTTPStatus
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+
+import model as ddpm
+
+
+# one queued "give me n faces" request; the future receives exactly its own n images
+class SampleRequest:
+    def __init__(self, n, future, enqueued):
+        self.n = n
+        self.future = future
+        self.enqueued = enqueued
+
+
+class SampleServer:
+    """Keeps one Unet resident and coalesces small sample requests into shared batches.
+
+    Requests already queued are merged without waiting; the batch then waits
+    for more only while its oldest request is within its `max_wait` budget, and
+    is closed once it holds `max_batch` images or that budget is spent.
+    """
+
+    def __init__(self, checkpoint, device="cpu", sampler="ddim", ddim_steps=50, max_batch=16, max_wait=0.05,
+                 max_request=4):
+        self.model, self.config = ddpm.load_checkpoint(checkpoint, device=device)
+        self.decoder, self.scale_factor = ddpm.load_decoder(self.config, device=device)
+
+        self.sampler = sampler
+        self.sampler_kwargs = {"ddim_steps": ddim_steps} if sampler == "ddim" else {}
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.max_request = max_request
+
+        self.queue = asyncio.Queue()
+        self.pending = None
+        # requests not yet in a batch (queued or carried over in `pending`)
+        self.waiting_requests = 0
+        self.waiting_images = 0
+        # sampling runs off the event loop so requests keep being accepted while a batch runs
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+        self.batches = 0
+        self.images_served = 0
+        self.batch_sizes = deque(maxlen=1000)
+        self.queue_waits = deque(maxlen=1000)
+        self.latencies = deque(maxlen=1000)
+
+    def generate(self, n):
+        shape = (n, self.config["channels"], self.config["image_size"], self.config["image_size"])
+        # only the final step is needed, so intermediate steps are never copied off the device
+        for latents in ddpm.progressive_samplers[self.sampler](self.model, shape, **self.sampler_kwargs):
+            pass
+        images = ddpm.decode(latents.cpu().numpy(), self.decoder, self.scale_factor)
+        return ((images + 1) * 127.5).clip(0, 255).astype(np.uint8).transpose(0, 2, 3, 1)
+
+    async def submit(self, n):
+        loop = asyncio.get_running_loop()
+        request = SampleRequest(n, loop.create_future(), loop.time())
+        self.waiting_requests += 1
+        self.waiting_images += n
+        await self.queue.put(request)
+        return await request.future
+
+    async def batch_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            first = self.pending or await self.queue.get()
+            self.pending = None
+
+            batch, total = [first], first.n
+            deadline = first.enqueued + self.max_wait
+            while total < self.max_batch:
+                try:
+                    request = self.queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    # nothing queued: wait only for what is left of the oldest request's budget
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        request = await asyncio.wait_for(self.queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                if total + request.n > self.max_batch:
+                    # does not fit: it opens the next batch instead
+                    self.pending = request
+                    break
+                batch.append(request)
+                total += request.n
+
+            self.waiting_requests -= len(batch)
+            self.waiting_images -= total
+            started = loop.time()
+            try:
+                images = await loop.run_in_executor(self.executor, self.generate, total)
+            except Exception as e:
+                for request in batch:
+                    if not request.future.done():
+                        request.future.set_exception(e)
+                continue
+            finished = loop.time()
+
+            offset = 0
+            for request in batch:
+                if not request.future.done():
+                    request.future.set_result(images[offset:offset + request.n])
+                offset += request.n
+                self.queue_waits.append(started - request.enqueued)
+                self.latencies.append(finished - request.enqueued)
+
+            self.batches += 1
+            self.images_served += total
+            self.batch_sizes.append(total)
+
+    def metrics(self):
+        return {
+            "queue_depth": self.waiting_requests,
+            "queued_images": self.waiting_images,
+            "batches": self.batches,
+            "images_served": self.images_served,
+            "mean_batch_size": float(np.mean(self.batch_sizes)) if self.batch_sizes else 0.0,
+            "queue_wait_ms": percentiles(self.queue_waits),
+            "latency_ms": percentiles(self.latencies),
+        }
+
+    async def route(self, method, path, body):
+        if method == "GET" and path == "/metrics":
+            return HTTPStatus.OK, self.metrics()
+        if method == "POST" and path == "/sample":
+            n = int(json.loads(body or b"{}").get("n", 1))
+            if not 1 <= n <= self.max_request:
+                return HTTPStatus.BAD_REQUEST, {"error": f"n must be between 1 and {self.max_request}"}
+            images = await self.submit(n)
+            return HTTPStatus.OK, {"images": [encode_png(image) for image in images]}
+        return HTTPStatus.NOT_FOUND, {"error": f"no route for {method} {path}"}
+
+    async def handle(self, reader, writer):
+        try:
+            request_line = await reader.readline()
+            if not request_line:
+                return
+            method, path, _ = request_line.decode("latin-1").split(" ", 2)
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get("content-length", 0)))
+            status, payload = await self.route(method, path, body)
+        except (ValueError, json.JSONDecodeError) as e:
+            status, payload = HTTPStatus.BAD_REQUEST, {"error": str(e)}
+        except Exception as e:
+            status, payload = HTTPStatus.INTERNAL_SERVER_ERROR, {"error": str(e)}
+
+        data = json.dumps(payload).encode()
+        writer.write(
+            f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+            f"Content-Type: application/json\r\n"
+            f"Content-Length: {len(data)}\r\n"
+            f"Connection: close\r\n\r\n".encode() + data
+        )
+        await writer.drain()
+        writer.close()
+
+    async def serve(self, host="127.0.0.1", port=8000, socket_path=None):
+        batcher = asyncio.create_task(self.batch_loop())
+        if socket_path:
+            server = await asyncio.start_unix_server(self.handle, path=socket_path)
+            print(f"Serving on unix socket {socket_path}")
+        else:
+            server = await asyncio.start_server(self.handle, host, port)
+            print(f"Serving on http://{host}:{port}")
+        async with server:
+            try:
+                await server.serve_forever()
+            finally:
+                batcher.cancel()
+
+
+def percentiles(values):
+    if not values:
+        return {"p50": 0.0, "p95": 0.0, "max": 0.0}
+    ms = np.asarray(values) * 1000
+    return {"p50": float(np.percentile(ms, 50)), "p95": float(np.percentile(ms, 95)), "max": float(ms.max())}
+
+
+def encode_png(image):
+    from PIL import Image
+    buffer = io.BytesIO()
+    Image.fromarray(image).save(buffer, format="PNG")
+    return base64.b64encode(buffer.getvalue()).decode("utf-8")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Dynamic-batching sampling server for a trained Unet.")
+    parser.add_argument("--checkpoint", default="results/model.pt")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--socket", default=None, help="serve on this unix socket instead of TCP")
+    parser.add_argument("--sampler", default="ddim", choices=sorted(ddpm.samplers))
+    parser.add_argument("--ddim-steps", type=int, default=50)
+    parser.add_argument("--max-batch", type=int, default=16, help="images per sampler call")
+    parser.add_argument("--max-wait-ms", type=float, default=50, help="latency budget for filling a batch")
+    args = parser.parse_args()
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+
+    async def run():
+        server = SampleServer(args.checkpoint, device=device, sampler=args.sampler, ddim_steps=args.ddim_steps,
+                              max_batch=args.max_batch, max_wait=args.max_wait_ms / 1000)
+        await server.serve(args.host, args.port, args.socket)
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
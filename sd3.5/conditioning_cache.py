@@ -0,0 +1,138 @@
+import os
+import json
+import hashlib
+from pathlib import Path
+from typing import Callable, List, Optional, Sequence
+
+import torch
+from safetensors import safe_open
+from safetensors.torch import load_file, save_file
+
+
+def file_sha256(path: str, chunk_size: int = 1 << 24) -> str:
+    """Returns the sha256 hex digest of a file's contents."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def encoder_fingerprint(paths: Sequence[str], cache_dir: str) -> str:
+    """Returns one hash identifying the exact text encoder checkpoints in use.
+
+    Content hashes of multi-GB checkpoints are expensive, so each one is memoized in
+    `cache_dir/fingerprints.json` under its (path, size, mtime) and only recomputed
+    when the file changes.
+
+    Args:
+        paths (Sequence[str]): Paths of the encoder checkpoints, in loader order.
+        cache_dir (str): Directory holding the memoized content hashes.
+
+    Returns:
+        str: sha256 hex digest over the individual checkpoint hashes.
+    """
+    memo_file = Path(cache_dir) / 'fingerprints.json'
+    memo = json.loads(memo_file.read_text()) if memo_file.exists() else {}
+
+    digest = hashlib.sha256()
+    for path in paths:
+        stat = os.stat(path)
+        memo_key = f"{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}"
+        if memo_key not in memo:
+            print(f"Hashing text encoder {path} (once per checkpoint file)")
+            memo[memo_key] = file_sha256(path)
+        digest.update(memo[memo_key].encode())
+
+    memo_file.parent.mkdir(parents=True, exist_ok=True)
+    memo_file.write_text(json.dumps(memo, indent=2))
+    return digest.hexdigest()
+
+
+def conditioning_to_tensors(conditioning: List) -> Optional[tuple]:
+    """Flattens a ComfyUI conditioning ([[tensor, {options}], ...]) for safetensors.
+
+    Returns:
+        Optional[tuple]: (tensors, metadata), or None if an option value can be
+        neither stored as a tensor nor as JSON (such entries are not cached).
+    """
+    tensors, options = {}, []
+    for i, (cond, extra) in enumerate(conditioning):
+        tensors[f"{i}.cond"] = cond.detach().cpu().contiguous()
+        plain = {}
+        for name, value in extra.items():
+            if isinstance(value, torch.Tensor):
+                tensors[f"{i}.{name}"] = value.detach().cpu().contiguous()
+            else:
+                try:
+                    json.dumps(value)
+                except TypeError:
+                    return None
+                plain[name] = value
+        options.append(plain)
+    return tensors, {"options": json.dumps(options)}
+
+
+def tensors_to_conditioning(tensors: dict, metadata: dict) -> List:
+    """Inverse of `conditioning_to_tensors`."""
+    conditioning = []
+    for i, plain in enumerate(json.loads(metadata["options"])):
+        extra = dict(plain)
+        prefix = f"{i}."
+        for name, value in tensors.items():
+            if name.startswith(prefix) and name != f"{i}.cond":
+                extra[name[len(prefix):]] = value
+        conditioning.append([tensors[f"{i}.cond"], extra])
+    return conditioning
+
+
+class ConditioningCache:
+    """On-disk cache of text conditionings keyed by text and encoder checkpoint hash.
+
+    Every entry is one safetensors file, written atomically, so concurrent or
+    interrupted runs never observe a partial entry.
+    """
+
+    def __init__(self, cache_dir: str, encoder_hash: str):
+        self.encoder_hash = encoder_hash
+        self.root = Path(cache_dir) / encoder_hash[:16]
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+
+    def path(self, text: str) -> Path:
+        key = hashlib.sha256(f"{self.encoder_hash}\0{text}".encode('utf-8')).hexdigest()
+        return self.root / key[:2] / f"{key}.safetensors"
+
+    def __contains__(self, text: str) -> bool:
+        return self.path(text).exists()
+
+    def get(self, text: str) -> Optional[List]:
+        path = self.path(text)
+        if not path.exists():
+            return None
+        with safe_open(str(path), framework='pt') as f:
+            metadata = f.metadata()
+        return tensors_to_conditioning(load_file(str(path)), metadata)
+
+    def put(self, text: str, conditioning: List) -> None:
+        flattened = conditioning_to_tensors(conditioning)
+        if flattened is None:
+            return
+        tensors, metadata = flattened
+        path = self.path(text)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        save_file(tensors, str(tmp_path), metadata=metadata)
+        os.replace(tmp_path, path)
+
+    def get_or_encode(self, text: str, encode: Callable[[str], List]) -> List:
+        """Returns the cached conditioning for `text`, encoding and storing it on a miss."""
+        conditioning = self.get(text)
+        if conditioning is not None:
+            self.hits += 1
+            return conditioning
+        self.misses += 1
+        conditioning = encode(text)
+        self.put(text, conditioning)
+        return conditioning
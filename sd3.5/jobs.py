@@ -0,0 +1,158 @@
+import os
+import json
+import time
+import socket
+import threading
+from pathlib import Path
+from contextlib import contextmanager
+from typing import Optional, Tuple
+
+
+STATES = ('pending', 'running', 'done', 'failed')
+# a claim whose heartbeat is older than this belongs to a worker that stopped (on any host)
+LEASE_SECONDS = 300.0
+
+
+def job_dirs(jobs_dir: str) -> dict:
+    """Creates (if needed) and returns the state subdirectories of a job directory."""
+    dirs = {state: Path(jobs_dir) / state for state in STATES}
+    for path in dirs.values():
+        path.mkdir(parents=True, exist_ok=True)
+    return dirs
+
+
+def write_json(path: Path, data: dict) -> None:
+    """Writes JSON atomically, so a watcher never reads a half-written file."""
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def submit_job(jobs_dir: str, job: dict) -> Path:
+    """Queues a generation job for a resident worker.
+
+    Args:
+        jobs_dir (str): Job directory watched by `update_sd3.5.py --serve`
+        job (dict): Either {"prompts": <prompt JSON path>} or {"prompt": <text>},
+            plus optional "key", "output_dir", "seed" and "batch_size"
+
+    Returns:
+        Path: The queued job file; it is moved to done/ or failed/ once processed.
+    """
+    if ('prompts' in job) == ('prompt' in job):
+        raise ValueError("A job needs exactly one of 'prompts' (a prompt file) or 'prompt' (a single prompt)")
+    job_id = f"{time.time_ns()}-{os.getpid()}"
+    path = job_dirs(jobs_dir)['pending'] / f"{job_id}.json"
+    write_json(path, {'id': job_id, 'submitted_at': time.time(), **job})
+    return path
+
+
+def pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def claim_name(name: str) -> str:
+    # hostnames may contain dots but never '+'
+    return f"{socket.gethostname()}+{os.getpid()}+{name}"
+
+
+def parse_claim(claim: str) -> Optional[Tuple[str, int, str]]:
+    """(hostname, pid, job file name) of a running/ file name, or None for foreign files."""
+    parts = claim.split('+', 2)
+    if len(parts) != 3 or not parts[1].isdigit():
+        return None
+    return parts[0], int(parts[1]), parts[2]
+
+
+def requeue_orphans(jobs_dir: str, lease: float = LEASE_SECONDS) -> int:
+    """Moves jobs claimed by workers that no longer run back to pending/.
+
+    A claim is orphaned if its worker ran on this host and its PID is gone, or if
+    its heartbeat (the claim file's mtime, see `heartbeat`) is older than `lease`.
+    Liveness of other hosts' PIDs cannot be checked, and a reused local PID can
+    look alive, so the lease is what catches those.
+
+    Generation journals the keys it completes, so a requeued job resumes where
+    the dead worker stopped.
+    """
+    dirs = job_dirs(jobs_dir)
+    requeued = 0
+    hostname = socket.gethostname()
+    now = time.time()
+    for path in dirs['running'].glob('*.json'):
+        claim = parse_claim(path.name)
+        if claim is None:
+            continue
+        host, pid, name = claim
+        try:
+            expired = now - path.stat().st_mtime > lease
+        except FileNotFoundError:
+            continue  # finished meanwhile
+        if expired or (host == hostname and not pid_alive(pid)):
+            try:
+                os.replace(path, dirs['pending'] / name)
+            except FileNotFoundError:
+                continue  # finished or requeued by another worker meanwhile
+            requeued += 1
+    return requeued
+
+
+@contextmanager
+def heartbeat(claimed: Path, interval: float = LEASE_SECONDS / 5):
+    """Keeps touching a claimed job file while its job runs, so other workers see it is alive."""
+    stop = threading.Event()
+
+    def beat():
+        while not stop.wait(interval):
+            try:
+                os.utime(claimed)
+            except FileNotFoundError:
+                return
+
+    thread = threading.Thread(target=beat, name='heartbeat', daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def claim_next(jobs_dir: str) -> Optional[Tuple[Path, dict]]:
+    """Claims the oldest pending job, or returns None if the queue is empty.
+
+    Claiming is an atomic rename into running/, so several workers can share one
+    job directory without processing a job twice.
+    """
+    dirs = job_dirs(jobs_dir)
+    for path in sorted(dirs['pending'].glob('*.json')):
+        claimed = dirs['running'] / claim_name(path.name)
+        try:
+            os.replace(path, claimed)
+        except FileNotFoundError:
+            continue  # another worker was faster
+        # the rename keeps the submission mtime; start the lease now
+        os.utime(claimed)
+        with open(claimed, 'r', encoding='utf-8') as f:
+            return claimed, json.load(f)
+    return None
+
+
+def finish_job(jobs_dir: str, claimed: Path, job: dict, error: Optional[str] = None, **result) -> Path:
+    """Records the outcome of a claimed job in done/ (or failed/ if `error` is set)."""
+    dirs = job_dirs(jobs_dir)
+    state = 'failed' if error is not None else 'done'
+    path = dirs[state] / f"{job['id']}.json"
+    outcome = {**job, **result, 'finished_at': time.time()}
+    if error is not None:
+        outcome['error'] = error
+    write_json(path, outcome)
+    claimed.unlink(missing_ok=True)
+    return path
@@ -0,0 +1,93 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from pathlib import Path
+from typing import Dict, Iterator, Tuple
+
+
+def key_seed(key: str, base_seed: int = 0) -> int:
+    """Returns a deterministic 64-bit sampler seed for a prompt key.
+
+    The seed only depends on the key and the run's base seed, so a retried,
+    resumed or differently sharded run renders the same image for the same key.
+    """
+    digest = hashlib.sha256(f"{base_seed}:{key}".encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big')
+
+
+def parse_shard(value: str) -> Tuple[int, int]:
+    """Parses an "i/n" shard spec (0 <= i < n)."""
+    index, count = (int(part) for part in value.split('/'))
+    if not 0 <= index < count:
+        raise ValueError(f"Shard {value} is not of the form i/n with 0 <= i < n")
+    return index, count
+
+
+def in_shard(idx: int, shard: Tuple[int, int]) -> bool:
+    """Whether the 1-based prompt number `idx` belongs to `shard`; shards never overlap."""
+    index, count = shard
+    return (idx - 1) % count == index
+
+
+def read_journal(path: Path) -> Iterator[dict]:
+    """Yields the entries of one journal, skipping a line torn by a crash."""
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                continue
+
+
+class Journal:
+    """Append-only JSONL record of completed prompts.
+
+    Each worker appends to its own file (journal.<i>-of-<n>.jsonl), but every
+    journal in the directory counts as done, so restarts and re-sharded runs skip
+    keys any worker already finished. Entries are fsynced as they are written;
+    `record` is safe to call from several saver threads.
+    """
+
+    def __init__(self, directory: str, shard: Tuple[int, int] = (0, 1)):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.path = self.directory / f"journal.{shard[0]}-of-{shard[1]}.jsonl"
+
+        self.entries = self.load_all()
+        self.file = open(self.path, 'a', encoding='utf-8')
+        self.lock = threading.Lock()
+
+    def load_all(self) -> Dict[str, dict]:
+        """Completed entries of every worker's journal in the directory, by key (latest wins)."""
+        entries = {}
+        for path in sorted(self.directory.glob('journal.*.jsonl')):
+            for entry in read_journal(path):
+                previous = entries.get(entry['key'])
+                if previous is None or entry.get('completed_at', 0) >= previous.get('completed_at', 0):
+                    entries[entry['key']] = entry
+        return entries
+
+    def done(self, key: str) -> bool:
+        return key in self.entries
+
+    def record(self, key: str, **fields) -> dict:
+        entry = {'key': key, **fields, 'completed_at': time.time()}
+        with self.lock:
+            self.file.write(json.dumps(entry, ensure_ascii=False) + '\n')
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.entries[key] = entry
+        return entry
+
+    def filename_mapping(self) -> dict:
+        """filename -> {key, prompt} for every prompt any worker has completed so far."""
+        entries = self.load_all()
+        return {
+            entry['filename']: {'key': entry['key'], 'prompt': entry['prompt']}
+            for entry in sorted(entries.values(), key=lambda entry: entry['filename'])
+        }
+
+    def close(self) -> None:
+        self.file.close()
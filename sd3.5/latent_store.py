@@ -0,0 +1,126 @@
+import os
+import time
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import torch
+from safetensors import safe_open
+from safetensors.torch import save_file
+
+
+class LatentShardWriter:
+    """Stores sampled latents in safetensors shards instead of decoding them.
+
+    Drop-in replacement for DecodeSavePipeline (same submit/close interface).
+    Latents are buffered and written `shard_size` images per file, one tensor per
+    image named after its image filename, in float16 to halve the footprint. A
+    prompt is only journaled once its shard is on disk, so an interrupted run
+    regenerates (at most) the unwritten buffer on resume.
+
+    Args:
+        directory (str): Output directory; shards go to its latents/ subdirectory
+        journal (Journal): Journal recording which shard holds each key
+        shard (Tuple[int, int]): Worker shard, part of the shard file names
+        shard_size (int): Images per shard file
+        telemetry (Telemetry): Optional per-prompt stage timings
+    """
+
+    def __init__(self, directory: str, journal, shard: Tuple[int, int] = (0, 1), shard_size: int = 256,
+                 telemetry=None):
+        self.root = Path(directory) / 'latents'
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.journal = journal
+        self.telemetry = telemetry
+        self.prefix = f"{shard[0]}-of-{shard[1]}"
+        self.shard_size = shard_size
+        # Resumed runs append new shard files instead of overwriting earlier ones (even with gaps in the numbering)
+        existing = [path.name[len(self.prefix) + 1:].split('.')[0]
+                    for path in self.root.glob(f"{self.prefix}.*.safetensors")]
+        self.sequence = max((int(index) + 1 for index in existing if index.isdigit()), default=0)
+        self.buffer = []
+
+    def submit(self, latent: dict, items: List[dict], timings: dict) -> None:
+        samples = latent['samples']
+        for i, item in enumerate(items):
+            item_timings = {**timings, 'encode': item['encode']} if 'encode' in item else timings
+            self.buffer.append((item, samples[i:i + 1].detach().to('cpu', torch.float16).contiguous(), item_timings))
+        if len(self.buffer) >= self.shard_size:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self.buffer:
+            return
+        path = self.root / f"{self.prefix}.{self.sequence:05d}.safetensors"
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        write_start = time.perf_counter()
+        save_file({item['filename']: tensor for item, tensor, _ in self.buffer}, str(tmp_path),
+                  metadata={item['filename']: item['key'] for item, _, _ in self.buffer})
+        os.replace(tmp_path, path)
+        write_time = time.perf_counter() - write_start
+
+        for item, _, timings in self.buffer:
+            timings = {**timings, 'save': write_time / len(self.buffer)}
+            if self.telemetry is not None:
+                self.telemetry.record(item['key'], timings)
+            self.journal.record(
+                item['key'],
+                filename=item['filename'],
+                prompt=item['prompt'],
+                seed=item['seed'],
+                latent=path.name,
+                timings={name: value for name, value in timings.items() if name != 'steps'},
+            )
+        self.sequence += 1
+        self.buffer = []
+
+    def close(self) -> None:
+        self.flush()
+
+
+def stored_latents(entries: Dict[str, dict], keys: Optional[List[str]] = None) -> List[dict]:
+    """Journal entries that have a stored latent and no decoded image yet.
+
+    Args:
+        entries (Dict[str, dict]): Journal entries by key (Journal.load_all)
+        keys (Optional[List[str]]): Restrict to these keys; all stored latents if None
+
+    Returns:
+        List[dict]: Entries in filename order
+    """
+    if keys is not None:
+        missing = [key for key in keys if key not in entries or 'latent' not in entries[key]]
+        if missing:
+            raise KeyError(f"No stored latent for {len(missing)} keys, e.g. {missing[0]!r}")
+        selected = [entries[key] for key in keys]
+    else:
+        selected = [entry for entry in entries.values() if 'latent' in entry]
+    selected = [entry for entry in selected if 'path' not in entry]
+    return sorted(selected, key=lambda entry: entry['filename'])
+
+
+def read_latent_batches(directory: str, entries: List[dict],
+                        batch_size: int) -> Iterator[Tuple[torch.Tensor, List[dict]]]:
+    """Yields (latents, entries) batches of up to `batch_size` stored latents.
+
+    Each shard file is opened once and only the selected tensors are read from
+    it; batches never mix latent shapes.
+    """
+    root = Path(directory) / 'latents'
+    by_shard = {}
+    for entry in entries:
+        by_shard.setdefault(entry['latent'], []).append(entry)
+
+    pending = {}
+    for shard_name, shard_entries in by_shard.items():
+        with safe_open(str(root / shard_name), framework='pt') as f:
+            for entry in shard_entries:
+                tensor = f.get_tensor(entry['filename'])
+                bucket = pending.setdefault(tuple(tensor.shape[1:]), [])
+                bucket.append((tensor, entry))
+                if len(bucket) == batch_size:
+                    yield torch.cat([t for t, _ in bucket]), [e for _, e in bucket]
+                    bucket.clear()
+
+    for bucket in pending.values():
+        if bucket:
+            yield torch.cat([t for t, _ in bucket]), [e for _, e in bucket]
@@ -0,0 +1,68 @@
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, List
+
+
+class DecodeSavePipeline:
+    """Runs image saving, and only image saving, off the sampling critical path.
+
+    VAE decode is not overlapped with sampling: every submitted latent group is
+    decoded right away and serially on the calling (sampling) thread. VAEDecode
+    goes through ComfyUI's model management, which is not thread-safe, so
+    decoding next to a running KSampler could offload the diffusion model
+    mid-sampling. Only the decoded images are handed to a thread pool (PNG
+    compression releases the GIL), so the next group starts sampling while they
+    are encoded and written. The sampler only blocks once
+    `2 * save_workers` images are waiting to be saved, which bounds the memory
+    held by the pipeline.
+
+    With threaded=False every image is saved inline, so the serial and
+    pipelined modes share one code path.
+
+    Args:
+        decode (Callable): latent -> batch of images
+        save (Callable): (item, single-image batch, timings) -> None
+        threaded (bool): Whether to save in background threads
+        save_workers (int): Threads encoding and writing images
+    """
+
+    def __init__(self, decode: Callable, save: Callable, threaded: bool = True, save_workers: int = 4):
+        self.decode = decode
+        self.save = save
+        self.threaded = threaded
+        self.error = None
+
+        if threaded:
+            self.savers = ThreadPoolExecutor(max_workers=save_workers, thread_name_prefix='save')
+            self.save_slots = threading.BoundedSemaphore(save_workers * 2)
+
+    def submit(self, latent: Any, items: List[dict], timings: dict) -> None:
+        """Decode one sampled group and save it; `items[i]` is saved from image i of the decoded batch."""
+        self.raise_error()
+        decode_start = time.perf_counter()
+        images = self.decode(latent)
+        timings = {**timings, 'decode': time.perf_counter() - decode_start}
+
+        for i, item in enumerate(items):
+            if self.threaded:
+                self.save_slots.acquire()
+                future = self.savers.submit(self.save, item, images[i:i + 1], timings)
+                future.add_done_callback(self.save_done)
+            else:
+                self.save(item, images[i:i + 1], timings)
+
+    def save_done(self, future) -> None:
+        self.save_slots.release()
+        if future.exception() is not None:
+            self.error = self.error or future.exception()
+
+    def raise_error(self) -> None:
+        if self.error is not None:
+            raise RuntimeError("Save worker failed") from self.error
+
+    def close(self) -> None:
+        """Wait until every submitted image is saved."""
+        if self.threaded:
+            self.savers.shutdown(wait=True)
+        self.raise_error()
@@ -0,0 +1,183 @@
+import os
+import json
+import time
+import argparse
+import resource
+import threading
+from pathlib import Path
+from collections import defaultdict
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import torch
+
+from journal import read_journal
+
+
+STAGES = ('encode', 'patch', 'sample', 'decode', 'save')
+# Stages run once per sampler or VAE batch rather than once per prompt
+BATCH_STAGES = ('patch', 'sample', 'decode')
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process so far, in MiB (ru_maxrss is KiB on Linux)."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def peak_vram_mb() -> float:
+    if not torch.cuda.is_available():
+        return 0.0
+    return torch.cuda.max_memory_allocated() / 2 ** 20
+
+
+class StepTimer:
+    """comfy.sample.sample callback recording the wall time of every sampler step.
+
+    The first step also includes moving the model to the device if it was offloaded.
+    """
+
+    def __init__(self):
+        self.last = time.perf_counter()
+        self.steps = []
+
+    def __call__(self, step, x0, x, total_steps):
+        now = time.perf_counter()
+        self.steps.append(now - self.last)
+        self.last = now
+
+
+class Telemetry:
+    """Per-prompt JSONL telemetry of one worker (telemetry.<i>-of-<n>.jsonl).
+
+    Every line holds one prompt's stage timings in seconds per image: stages run
+    once per batch (patch, sample, decode and the per-step times) are divided by
+    the batch size. A prompt can have several lines, e.g. one from a latents-only
+    run and one from decoding it later. The file is appended to across resumed
+    runs; every line carries the id of the run that wrote it. `record` is safe to
+    call from several saver threads.
+    """
+
+    def __init__(self, directory: str, shard: Tuple[int, int] = (0, 1)):
+        self.path = Path(directory) / f"telemetry.{shard[0]}-of-{shard[1]}.jsonl"
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.file = open(self.path, 'a', encoding='utf-8')
+        self.lock = threading.Lock()
+        self.run = f"{time.time_ns()}-{os.getpid()}"
+
+    def record(self, key: str, timings: dict) -> None:
+        batch_size = timings.get('batch_size', 1)
+        entry = {'key': key, 'time': time.time(), 'run': self.run}
+        for name, value in timings.items():
+            if name in BATCH_STAGES:
+                value = value / batch_size
+            elif name == 'steps':
+                value = [step / batch_size for step in value]
+            entry[name] = value
+        entry['peak_rss_mb'] = round(peak_rss_mb(), 1)
+        entry['peak_vram_mb'] = round(peak_vram_mb(), 1)
+        with self.lock:
+            self.file.write(json.dumps(entry) + '\n')
+            self.file.flush()
+
+    def close(self) -> None:
+        self.file.close()
+
+
+def read_telemetry(paths: List[Path], run: Optional[str] = None) -> Iterator[dict]:
+    """Telemetry entries of the given files, only those of one run if `run` is set."""
+    for path in paths:
+        for entry in read_journal(path):
+            if run is None or entry.get('run') == run:
+                yield entry
+
+
+def images_per_hour(entries: List[dict]) -> float:
+    """Wall clock throughput, counting only the time runs were active (not the gaps between resumed runs)."""
+    finished = defaultdict(list)
+    for entry in entries:
+        # lines written before runs were tagged count as one run
+        finished[entry.get('run')].append(entry['time'])
+    # Entries are written as images finish, so each run's span starts one image early
+    images = sum(len(times) - 1 for times in finished.values())
+    span = sum(max(times) - min(times) for times in finished.values())
+    return images / span * 3600 if span > 0 else float('nan')
+
+
+def summarize(entries: List[dict]) -> Dict:
+    """Throughput and per-image stage breakdown of telemetry entries.
+
+    Lines of the same prompt are merged (a later save time replaces an earlier
+    one), so a latents-only run and its deferred decode count as one image.
+    Throughput is measured per run, so idle time between resumed runs is excluded.
+    """
+    if not entries:
+        return {'images': 0}
+    rate = images_per_hour(entries)
+
+    merged = {}
+    for entry in sorted(entries, key=lambda entry: entry['time']):
+        merged.setdefault(entry['key'], {}).update(entry)
+    entries = list(merged.values())
+
+    per_image = defaultdict(list)
+    step_times = []
+    for entry in entries:
+        for stage in STAGES:
+            if stage in entry:
+                per_image[stage].append(entry[stage])
+        step_times.extend(entry.get('steps', []))
+
+    # Stages some images skip (e.g. the one-off model patch) are still averaged over every image
+    stage_total = sum(sum(times) for times in per_image.values())
+    stages = {
+        stage: {
+            'mean_s': sum(times) / len(entries),
+            'share': sum(times) / stage_total if stage_total else 0.0,
+        }
+        for stage, times in per_image.items()
+    }
+    steps = sorted(step_times)
+    return {
+        'images': len(entries),
+        'images_per_hour': rate,
+        'stages': stages,
+        'step_p50_s': steps[len(steps) // 2] if steps else None,
+        'step_max_s': steps[-1] if steps else None,
+        'peak_rss_mb': max(entry.get('peak_rss_mb', 0) for entry in entries),
+        'peak_vram_mb': max(entry.get('peak_vram_mb', 0) for entry in entries),
+    }
+
+
+def format_summary(summary: Dict) -> str:
+    if not summary['images']:
+        return "No telemetry recorded"
+    lines = [
+        f"{summary['images']} images, {summary['images_per_hour']:.0f} images/hour (wall clock)",
+        f"{'stage':<8} {'s/image':>9} {'share':>7}",
+    ]
+    for stage in STAGES:
+        if stage in summary['stages']:
+            stats = summary['stages'][stage]
+            lines.append(f"{stage:<8} {stats['mean_s']:>9.3f} {stats['share']:>7.1%}")
+    if summary['step_p50_s'] is not None:
+        lines.append(f"sampler step: p50 {summary['step_p50_s'] * 1000:.1f} ms/image, "
+                     f"max {summary['step_max_s'] * 1000:.1f} ms/image")
+    lines.append(f"peak RSS {summary['peak_rss_mb']:.0f} MiB, peak VRAM {summary['peak_vram_mb']:.0f} MiB")
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize SD3.5 generation telemetry.")
+    parser.add_argument('paths', nargs='+',
+                        help="telemetry JSONL files, or output directories (every worker's telemetry is merged)")
+    parser.add_argument('--json', action='store_true', help="print the summary as JSON")
+    args = parser.parse_args()
+
+    paths = []
+    for path in map(Path, args.paths):
+        paths.extend(sorted(path.glob('telemetry.*.jsonl')) if path.is_dir() else [path])
+    summary = summarize(list(read_telemetry(paths)))
+    print(json.dumps(summary, indent=2) if args.json else format_summary(summary))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+import importlib.util
+from pathlib import Path
+
+import pytest
+
+torch = pytest.importorskip("torch")
+
+# update_sd3.5.py is not an importable module name
+spec = importlib.util.spec_from_file_location("update_sd35", Path(__file__).with_name("update_sd3.5.py"))
+update_sd35 = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(update_sd35)
+
+update_sd35.add_comfyui_directory_to_sys_path()
+pytest.importorskip("comfy")
+folder_paths = pytest.importorskip("folder_paths")
+
+PROMPTS = {
+    "verify-1": {"prompt": "A red bicycle leaning against a brick wall in the rain."},
+    "verify-2": {"prompt": "\"An empty classroom at dawn, chairs stacked on the desks.\""},
+}
+
+
+@pytest.fixture(scope="module")
+def generator():
+    if folder_paths.get_full_path("checkpoints", "sd3.5_medium.safetensors") is None:
+        pytest.skip("sd3.5_medium.safetensors is not in the ComfyUI model folders")
+    try:
+        update_sd35.text_encoder_paths()
+    except FileNotFoundError as e:
+        pytest.skip(str(e))
+    update_sd35.setup_comfyui()
+    return update_sd35.Generator()
+
+
+def test_job_plan_matches_the_per_prompt_graph(generator):
+    with torch.inference_mode():
+        assert update_sd35.verify_plan(generator, PROMPTS, count=len(PROMPTS), seed=0)
@@ -1,11 +1,24 @@
+import gc
 import os
-import random
 import sys
+import time
+import shutil
+import argparse
+import tempfile
+from functools import partial
+from collections import defaultdict
 from typing import Sequence, Mapping, Any, Union
 import torch
 import json
 from pathlib import Path
 
+from conditioning_cache import ConditioningCache, encoder_fingerprint
+from journal import Journal, in_shard, key_seed, parse_shard
+from jobs import claim_next, finish_job, heartbeat, requeue_orphans, submit_job
+from pipeline import DecodeSavePipeline
+from telemetry import StepTimer, Telemetry, format_summary, read_telemetry, summarize
+from latent_store import LatentShardWriter, read_latent_batches, stored_latents
+
 
 def get_value_at_index(obj: Union[Sequence, Mapping], index: int) -> Any:
     """Returns the value at the given index of a sequence or mapping.
@@ -87,10 +100,6 @@ def add_extra_model_paths() -> None:
         print("Could not find the extra_model_paths config file.")
 
 
-add_comfyui_directory_to_sys_path()
-add_extra_model_paths()
-
-
 def import_custom_nodes() -> None:
     """Find all custom nodes in the custom_nodes folder and add those node objects to NODE_CLASS_MAPPINGS
 
@@ -114,7 +123,17 @@ def import_custom_nodes() -> None:
     init_extra_nodes()
 
 
-from nodes import NODE_CLASS_MAPPINGS
+# set by setup_comfyui(), which only the code paths that run models call
+NODE_CLASS_MAPPINGS = None
+
+
+def setup_comfyui() -> None:
+    """Make ComfyUI importable and load its node classes and custom nodes."""
+    global NODE_CLASS_MAPPINGS
+    add_comfyui_directory_to_sys_path()
+    add_extra_model_paths()
+    from nodes import NODE_CLASS_MAPPINGS
+    import_custom_nodes()
 
 
 def load_prompts(json_path):
@@ -132,131 +151,736 @@ def save_filename_mapping(mapping, output_dir):
         output_dir (str): Directory to save the mapping file
     """
     mapping_file = Path(output_dir) / 'filename_mapping.json'
-    with open(mapping_file, 'w', encoding='utf-8') as f:
+    tmp_file = mapping_file.with_suffix(f'.{os.getpid()}.tmp')
+    with open(tmp_file, 'w', encoding='utf-8') as f:
         json.dump(mapping, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_file, mapping_file)
 
 
-def main():
-    import_custom_nodes()
-    
-    # Load prompts from JSON
-    prompts = load_prompts('output.json')
-    
-    # Create output directory
-    output_dir = 'generated_images'
-    Path(output_dir).mkdir(exist_ok=True)
-    
-    # Dictionary to store filename mappings
-    filename_mapping = {}
-    
-    with torch.inference_mode():
-        # Initialize models (only need to do this once)
-        checkpointloadersimple = NODE_CLASS_MAPPINGS["CheckpointLoaderSimple"]()
-        checkpointloadersimple = checkpointloadersimple.load_checkpoint(
-            ckpt_name="sd3.5_medium.safetensors"
+CLIP_NAMES = ("clip_g.safetensors", "clip_l.safetensors", "t5xxl_fp16.safetensors")
+NEGATIVE_PROMPT = "watermark"
+
+
+def text_encoder_paths(clip_names=CLIP_NAMES):
+    """Resolve the TripleCLIPLoader checkpoint names to files in the ComfyUI model folders."""
+    import folder_paths
+
+    paths = []
+    for name in clip_names:
+        path = folder_paths.get_full_path("text_encoders", name) or folder_paths.get_full_path("clip", name)
+        if path is None:
+            raise FileNotFoundError(f"Text encoder {name} not found in the ComfyUI model folders")
+        paths.append(path)
+    return paths
+
+
+class TextEncoder:
+    """CLIPTextEncode behind the optional on-disk conditioning cache.
+
+    The TripleCLIPLoader models (CLIP-G, CLIP-L, T5-XXL) are only loaded on the first
+    cache miss, so a fully cached rerun never loads the text encoders at all.
+    """
+
+    def __init__(self, cache=None):
+        self.cache = cache
+        self.clip = None
+        self.unloaded = False
+        self.cliptextencode = NODE_CLASS_MAPPINGS["CLIPTextEncode"]()
+
+    def load_clip(self):
+        if self.clip is None:
+            if self.unloaded:
+                raise RuntimeError("Text encoders were unloaded but a conditioning is missing from the store")
+            triplecliploader = NODE_CLASS_MAPPINGS["TripleCLIPLoader"]()
+            triplecliploader = triplecliploader.load_clip(
+                clip_name1=CLIP_NAMES[0],
+                clip_name2=CLIP_NAMES[1],
+                clip_name3=CLIP_NAMES[2],
+            )
+            self.clip = get_value_at_index(triplecliploader, 0)
+        return self.clip
+
+    def encode_uncached(self, text):
+        cliptextencode_output = self.cliptextencode.encode(text=text, clip=self.load_clip())
+        return get_value_at_index(cliptextencode_output, 0)
+
+    def encode(self, text):
+        if self.cache is None:
+            return self.encode_uncached(text)
+        return self.cache.get_or_encode(text, self.encode_uncached)
+
+    def unload(self):
+        """Release CLIP-G, CLIP-L and T5-XXL from VRAM and RAM; later encodes must hit the cache."""
+        import comfy.model_management
+
+        self.unloaded = True
+        if self.clip is None:
+            return
+        self.clip = None
+        comfy.model_management.unload_all_models()
+        gc.collect()
+        comfy.model_management.soft_empty_cache()
+
+
+def load_diffusion_checkpoint(ckpt_name="sd3.5_medium.safetensors"):
+    """Load the diffusion model and VAE of a checkpoint without any text encoders it may bundle.
+
+    Returns the same (model, clip, vae, ...) layout as CheckpointLoaderSimple, with clip None.
+    """
+    import comfy.sd
+    import folder_paths
+
+    ckpt_path = folder_paths.get_full_path("checkpoints", ckpt_name)
+    return comfy.sd.load_checkpoint_guess_config(
+        ckpt_path,
+        output_vae=True,
+        output_clip=False,
+        embedding_directory=folder_paths.get_folder_paths("embeddings"),
+    )
+
+
+def load_vae(ckpt_name="sd3.5_medium.safetensors"):
+    """Load only the VAE of a checkpoint, for decoding stored latents without the diffusion model."""
+    import comfy.sd
+    import comfy.utils
+    import folder_paths
+
+    state_dict = comfy.utils.load_torch_file(folder_paths.get_full_path("checkpoints", ckpt_name))
+    vae_state_dict = comfy.utils.state_dict_prefix_replace(state_dict, {"first_stage_model.": ""}, filter_keys=True)
+    return comfy.sd.VAE(sd=vae_state_dict)
+
+
+def build_negative_conditioning(text_encoder):
+    """Build the constant negative conditioning chain once.
+
+    The "watermark" embedding is zeroed out for the first 10% of the schedule and
+    used as-is everywhere, exactly as the original per-prompt graph did.
+    """
+    conditioningzeroout = NODE_CLASS_MAPPINGS["ConditioningZeroOut"]()
+    conditioningsettimesteprange = NODE_CLASS_MAPPINGS["ConditioningSetTimestepRange"]()
+    conditioningcombine = NODE_CLASS_MAPPINGS["ConditioningCombine"]()
+
+    negative = text_encoder.encode(NEGATIVE_PROMPT)
+
+    conditioningzeroout_output = conditioningzeroout.zero_out(conditioning=negative)
+
+    conditioningsettimesteprange_1 = conditioningsettimesteprange.set_range(
+        start=0.1,
+        end=1,
+        conditioning=get_value_at_index(conditioningzeroout_output, 0),
+    )
+
+    conditioningsettimesteprange_2 = conditioningsettimesteprange.set_range(
+        start=0,
+        end=1,
+        conditioning=negative,
+    )
+
+    conditioningcombine_output = conditioningcombine.combine(
+        conditioning_1=get_value_at_index(conditioningsettimesteprange_1, 0),
+        conditioning_2=get_value_at_index(conditioningsettimesteprange_2, 0),
+    )
+    return get_value_at_index(conditioningcombine_output, 0)
+
+
+def ksample(model, seeds, positive, negative, latent, steps=30, cfg=8, sampler_name="euler",
+            scheduler="normal", denoise=1.0, callback=None):
+    """KSampler.sample with one seed per batch item.
+
+    The noise for every item is drawn from its own seed exactly as KSampler draws
+    it for a single image, so an image depends only on its key's seed and not on
+    which group it was batched into.
+
+    Returns:
+        tuple: (latent,) in the same layout as KSampler.sample
+    """
+    import comfy.sample
+
+    latent_image = latent["samples"]
+    if hasattr(comfy.sample, "fix_empty_latent_channels"):
+        latent_image = comfy.sample.fix_empty_latent_channels(model, latent_image)
+
+    noise = torch.cat([
+        comfy.sample.prepare_noise(latent_image[i:i + 1], seed) for i, seed in enumerate(seeds)
+    ])
+
+    samples = comfy.sample.sample(
+        model, noise, steps, cfg, sampler_name, scheduler, positive, negative, latent_image,
+        denoise=denoise, noise_mask=latent.get("noise_mask"), callback=callback, seed=seeds[0],
+    )
+    out = latent.copy()
+    out["samples"] = samples
+    return (out,)
+
+
+def saved_image_path(saveimage_output):
+    """Path of the single image written by SaveImage.save_images."""
+    import folder_paths
+
+    image = saveimage_output["ui"]["images"][0]
+    return str(Path(folder_paths.get_output_directory()) / image["subfolder"] / image["filename"])
+
+
+def journal_timings(timings):
+    """Stage timings as kept in the journal; per-step times only go to the telemetry."""
+    return {name: value for name, value in timings.items() if name != 'steps'}
+
+
+def stack_conditionings(conditionings):
+    """Stack single-entry conditionings of equal shape into one batched conditioning.
+
+    Tensor options (e.g. pooled_output) are concatenated along the batch dimension,
+    everything else is taken from the first conditioning.
+    """
+    first_cond, first_options = conditionings[0][0]
+    options = {}
+    for name, value in first_options.items():
+        if isinstance(value, torch.Tensor):
+            options[name] = torch.cat([conditioning[0][1][name] for conditioning in conditionings])
+        else:
+            options[name] = value
+    return [[torch.cat([conditioning[0][0] for conditioning in conditionings]), options]]
+
+
+def encode_prompts(items, text_encoder):
+    """Encode every prompt up front, writing it to the conditioning store.
+
+    Records each item's conditioning shape in item['length'] for bucketing and its
+    encoding time in item['encode']. The tensors themselves are only kept by the
+    store and reloaded when their group is sampled.
+
+    Args:
+        items (list): Prompt items with 'prompt', 'key' and 'filename' entries
+        text_encoder (TextEncoder): Encoder used for the prompts; its cache is the store
+    """
+    for item in items:
+        encode_start = time.perf_counter()
+        conditioning = text_encoder.encode(item['prompt'])
+        item['encode'] = time.perf_counter() - encode_start
+        item['length'] = tuple(conditioning[0][0].shape[1:])
+
+
+def plan_batches(items, batch_size):
+    """Group prompt items into sampler batches.
+
+    Conditionings can only be stacked when their token length matches, so with
+    batch_size > 1 items (already passed through `encode_prompts`) are bucketed
+    by conditioning shape before being chunked.
+
+    Args:
+        items (list): Prompt items with 'prompt', 'key' and 'filename' entries
+        batch_size (int): Maximum number of prompts per KSampler call
+
+    Returns:
+        list: Groups of items, each sampled with one KSampler call
+    """
+    if batch_size == 1:
+        return [[item] for item in items]
+
+    buckets = defaultdict(list)
+    for item in items:
+        buckets[item['length']].append(item)
+
+    groups = []
+    for bucket in buckets.values():
+        for start in range(0, len(bucket), batch_size):
+            groups.append(bucket[start:start + batch_size])
+    return groups
+
+
+class JobPlan:
+    """The prompt-invariant part of the SD3.5 graph, evaluated once.
+
+    The original per-prompt graph rebuilt ModelSamplingSD3, the negative
+    conditioning chain and the empty latent for every prompt although only the
+    positive text and the seed change. A plan holds those node outputs, so
+    `sample` only evaluates the prompt-dependent KSampler.
+
+    Args:
+        model: Diffusion model (ModelPatcher) of the loaded checkpoint
+        negative (list): Negative conditioning (see build_negative_conditioning)
+        shift (float): ModelSamplingSD3 shift
+    """
+
+    def __init__(self, model, negative, shift=3, steps=30, cfg=8, sampler_name="euler", scheduler="normal",
+                 width=512, height=512):
+        modelsamplingsd3 = NODE_CLASS_MAPPINGS["ModelSamplingSD3"]()
+        self.model = get_value_at_index(modelsamplingsd3.patch(shift=shift, model=model), 0)
+        self.negative = negative
+        self.steps = steps
+        self.cfg = cfg
+        self.sampler_name = sampler_name
+        self.scheduler = scheduler
+        self.width = width
+        self.height = height
+
+        self.emptylatentimage = NODE_CLASS_MAPPINGS["EmptyLatentImage"]()
+        # One empty latent per group size, created on first use
+        self.empty_latents = {}
+
+    def empty_latent(self, batch_size):
+        if batch_size not in self.empty_latents:
+            self.empty_latents[batch_size] = self.emptylatentimage.generate(
+                width=self.width, height=self.height, batch_size=batch_size
+            )
+        return get_value_at_index(self.empty_latents[batch_size], 0)
+
+    def sample(self, positive, seeds, callback=None):
+        """Sample one latent per seed; `positive` is the (stacked) conditioning of the group."""
+        ksampler_output = ksample(
+            seeds=seeds,
+            steps=self.steps,
+            cfg=self.cfg,
+            sampler_name=self.sampler_name,
+            scheduler=self.scheduler,
+            denoise=1,
+            model=self.model,
+            positive=positive,
+            negative=self.negative,
+            latent=self.empty_latent(len(seeds)),
+            callback=callback,
         )
+        return get_value_at_index(ksampler_output, 0)
+
+
+class Generator:
+    """SD3.5 text encoders, diffusion model and graph nodes, loaded once per process.
 
-        emptylatentimage = NODE_CLASS_MAPPINGS["EmptyLatentImage"]()
-        emptylatentimage = emptylatentimage.generate(
-            width=512, height=512, batch_size=1
+    `run` can be called any number of times (once per prompt file or job), so a
+    resident worker pays the ComfyUI start-up and the checkpoint loads only once.
+    The diffusion checkpoint is loaded on first use, which lets a two-phase run
+    free the text encoders before it is loaded.
+    """
+
+    def __init__(self, cache=None, ckpt_name="sd3.5_medium.safetensors"):
+        self.cache = cache
+        self.text_encoder = TextEncoder(cache)
+        self.ckpt_name = ckpt_name
+        self.checkpoint = None
+        self.vae_only = None
+        self.negative_conditioning = None
+        self.job_plan = None
+
+        self.vaedecode = NODE_CLASS_MAPPINGS["VAEDecode"]()
+        self.saveimage = NODE_CLASS_MAPPINGS["SaveImage"]()
+
+    def load(self):
+        """Load every model up front instead of on first use (for resident workers)."""
+        self.text_encoder.load_clip()
+        self.negative()
+        self.load_checkpoint()
+
+    def load_checkpoint(self):
+        if self.checkpoint is None:
+            self.checkpoint = load_diffusion_checkpoint(self.ckpt_name)
+        return self.checkpoint
+
+    def negative(self):
+        # The negative conditioning never changes, so its chain is built once per process
+        if self.negative_conditioning is None:
+            self.negative_conditioning = build_negative_conditioning(self.text_encoder)
+        return self.negative_conditioning
+
+    def plan(self):
+        # Prompt-invariant nodes are evaluated once per process, not per prompt or job
+        if self.job_plan is None:
+            self.job_plan = JobPlan(get_value_at_index(self.load_checkpoint(), 0), self.negative())
+        return self.job_plan
+
+    def vae(self):
+        if self.checkpoint is not None:
+            return get_value_at_index(self.checkpoint, 2)
+        if self.vae_only is None:
+            self.vae_only = load_vae(self.ckpt_name)
+        return self.vae_only
+
+    def decode_latent(self, latent):
+        vaedecode_output = self.vaedecode.decode(
+            samples=latent,
+            vae=self.vae(),
+        )
+        return get_value_at_index(vaedecode_output, 0)
+
+    def save_image(self, journal, telemetry, output_dir, item, image, timings):
+        # Filename prefixes are unique per prompt, so SaveImage is safe to run from several threads
+        save_start = time.perf_counter()
+        saveimage_output = self.saveimage.save_images(
+            filename_prefix=str(Path(output_dir) / item['filename']),
+            images=image,
         )
+        timings = {**timings, 'save': time.perf_counter() - save_start}
+        if 'encode' in item:
+            timings['encode'] = item['encode']
+        telemetry.record(item['key'], timings)
+
+        # Images decoded from stored latents keep the entry's latent and sampling timings
+        journal.record(
+            item['key'],
+            filename=item['filename'],
+            prompt=item['prompt'],
+            seed=item['seed'],
+            **({'latent': item['latent']} if 'latent' in item else {}),
+            path=saved_image_path(saveimage_output),
+            timings={**item.get('timings', {}), **journal_timings(timings)},
+        )
+
+    def run(self, prompts, output_dir, shard=(0, 1), seed=0, batch_size=1, two_phase=False, pipeline=False,
+            save_workers=4, latents_only=False, shard_size=256):
+        """Generate one image per prompt not yet in the output directory's journals.
+
+        Args:
+            prompts (dict): {key: {'prompt': ...}}, numbered in iteration order
+            output_dir (str): Directory for the images, journals and filename mapping
+            shard (tuple): (i, n) - only prompts whose number is i modulo n are generated
+            seed (int): Base seed each key's seed is derived from
+            batch_size (int): Maximum number of prompts per KSampler call
+            two_phase (bool): Encode every prompt, unload the text encoders, then sample
+            pipeline (bool): Save images in background threads while the next group samples
+            save_workers (int): Threads writing images with pipeline=True
+            latents_only (bool): Store the sampled latents (see `decode_stored`) instead of images
+            shard_size (int): Latents per safetensors file with latents_only=True
+
+        Returns:
+            int: Number of images generated
+        """
+        Path(output_dir).mkdir(parents=True, exist_ok=True)
+
+        # Completed keys (from any shard) are skipped, new ones are appended as they finish
+        journal = Journal(output_dir, shard)
+        telemetry = Telemetry(output_dir, shard)
+        spill_dir = None
+
+        try:
+            # Collect prompts, numbering them in file order
+            items = []
+            for idx, (key, data) in enumerate(prompts.items(), 1):
+                prompt = data.get('prompt', '').strip('"')  # Remove quotes if present
+                if not prompt:
+                    continue
+
+                if not in_shard(idx, shard) or journal.done(key):
+                    continue
+
+                # Create numbered filename; it depends on the position in the full prompt file, not the shard
+                filename = f"image_{idx:04d}"  # Creates filenames like image_0001, image_0002, etc.
+                items.append({
+                    'idx': idx, 'key': key, 'prompt': prompt, 'filename': filename,
+                    'seed': key_seed(key, seed),
+                })
+
+            print(f"Shard {shard[0]}/{shard[1]}: {len(items)} prompts left to generate")
+            if not items:
+                save_filename_mapping(journal.filename_mapping(), output_dir)
+                return 0
+
+            # Phase 1 (with two_phase or batching): encode every prompt into the store
+            if two_phase or batch_size > 1:
+                if self.text_encoder.cache is None:
+                    # Without a cache the conditionings wait for their group in a temporary store on disk;
+                    # kept in RAM, a T5 conditioning per prompt adds up to gigabytes
+                    spill_dir = tempfile.mkdtemp(prefix='.conditionings-', dir=output_dir)
+                    self.text_encoder.cache = ConditioningCache(spill_dir, 'run-local')
+                encode_prompts(items, self.text_encoder)
+
+            # The negative conditioning needs the text encoders, so it is built before they can be freed
+            self.negative()
+
+            if two_phase:
+                # Phase 2 only reads stored conditionings, so the text encoders are freed
+                # before the diffusion model is even loaded
+                self.text_encoder.unload()
+
+            self.load_checkpoint()
+            patch_start = time.perf_counter()
+            plan = self.plan()
+            # Only the group building the plan pays for patching the model
+            patch_time = time.perf_counter() - patch_start
+
+            if latents_only:
+                # Decoding is deferred to `decode_stored`, for whichever keys end up being needed
+                decode_save = LatentShardWriter(output_dir, journal, shard, shard_size=shard_size,
+                                                telemetry=telemetry)
+            else:
+                # Sampled latents are decoded on this thread and saved behind the sampler (inline without pipeline)
+                decode_save = DecodeSavePipeline(self.decode_latent,
+                                                 partial(self.save_image, journal, telemetry, output_dir),
+                                                 threaded=pipeline, save_workers=save_workers)
+
+            # Generate images, one KSampler call per group of prompts
+            try:
+                for group in plan_batches(items, batch_size):
+                    for item in group:
+                        print(f"Generating image {item['idx']}/{len(prompts)}: {item['key']}")
+
+                    # Encode text (served from the conditioning cache when possible)
+                    conditionings = []
+                    for item in group:
+                        encode_start = time.perf_counter()
+                        conditionings.append(self.text_encoder.encode(item['prompt']))
+                        item['encode'] = item.get('encode', 0.0) + time.perf_counter() - encode_start
+                    positive_conditioning = stack_conditionings(conditionings)
+
+                    sample_start = time.perf_counter()
+                    step_timer = StepTimer()
+                    latent = plan.sample(positive_conditioning, [item['seed'] for item in group], callback=step_timer)
+
+                    # The decoded batch is split back into one numbered file per prompt
+                    decode_save.submit(
+                        latent,
+                        group,
+                        {
+                            'batch_size': len(group),
+                            'patch': patch_time,
+                            'sample': time.perf_counter() - sample_start,
+                            'steps': step_timer.steps,
+                        },
+                    )
+                    patch_time = 0.0
+            finally:
+                # Also on failure, so a resident worker does not keep a save pool per failed job
+                decode_save.close()
+
+            if self.cache is not None:
+                print(f"Conditioning cache: {self.cache.hits} hits, {self.cache.misses} misses")
+
+            # Save the filename mapping of everything completed so far, across all shards
+            save_filename_mapping(journal.filename_mapping(), output_dir)
+        finally:
+            journal.close()
+            telemetry.close()
+            if spill_dir is not None:
+                self.text_encoder.cache = self.cache
+                shutil.rmtree(spill_dir, ignore_errors=True)
+
+        # The file also holds earlier runs of this output directory; only this run is summarized
+        print(format_summary(summarize(list(read_telemetry([telemetry.path], run=telemetry.run)))))
+        return len(items)
+
+    def decode_stored(self, output_dir, keys=None, batch_size=16, pipeline=False, save_workers=4):
+        """Decode latents stored by a latents-only run into images, in large VAE batches.
+
+        Only the VAE is loaded. Keys that already have an image are skipped, so the
+        command can be rerun with growing key selections.
+
+        Args:
+            output_dir (str): Output directory of the latents-only run
+            keys (list): Keys to decode; every stored latent if None
+            batch_size (int): Latents per VAE decode call
+            pipeline (bool): Save images in background threads while the next batch decodes
+            save_workers (int): Threads writing images with pipeline=True
+
+        Returns:
+            int: Number of images decoded
+        """
+        journal = Journal(output_dir)
+        telemetry = Telemetry(output_dir)
+        entries = stored_latents(journal.entries, keys)
+        print(f"Decoding {len(entries)} stored latents")
+
+        decode_save = DecodeSavePipeline(self.decode_latent, partial(self.save_image, journal, telemetry, output_dir),
+                                         threaded=pipeline, save_workers=save_workers)
+        for latents, batch in read_latent_batches(output_dir, entries, batch_size):
+            decode_save.submit({'samples': latents}, batch, {'batch_size': len(batch)})
+        decode_save.close()
+
+        save_filename_mapping(journal.filename_mapping(), output_dir)
+        journal.close()
+        telemetry.close()
+        return len(entries)
+
+
+def verify_plan(generator, prompts, count=2, seed=0):
+    """Check that the job plan samples bit-identical latents to the original per-prompt graph.
+
+    The reference rebuilds every node for each prompt and samples with the stock
+    KSampler node, exactly as the graph exported from ComfyUI did.
 
-        triplecliploader = NODE_CLASS_MAPPINGS["TripleCLIPLoader"]()
-        triplecliploader = triplecliploader.load_clip(
-            clip_name1="clip_g.safetensors",
-            clip_name2="clip_l.safetensors",
-            clip_name3="t5xxl_fp16.safetensors",
+    Returns:
+        bool: Whether every compared latent matched
+    """
+    ksampler = NODE_CLASS_MAPPINGS["KSampler"]()
+    modelsamplingsd3 = NODE_CLASS_MAPPINGS["ModelSamplingSD3"]()
+    emptylatentimage = NODE_CLASS_MAPPINGS["EmptyLatentImage"]()
+    checkpointloadersimple = generator.load_checkpoint()
+    plan = generator.plan()
+
+    matched = True
+    for key, data in list(prompts.items())[:count]:
+        prompt = data.get('prompt', '').strip('"')
+        positive = generator.text_encoder.encode(prompt)
+        item_seed = key_seed(key, seed)
+
+        modelsamplingsd3_output = modelsamplingsd3.patch(
+            shift=3,
+            model=get_value_at_index(checkpointloadersimple, 0),
         )
+        reference = ksampler.sample(
+            seed=item_seed,
+            steps=30,
+            cfg=8,
+            sampler_name="euler",
+            scheduler="normal",
+            denoise=1,
+            model=get_value_at_index(modelsamplingsd3_output, 0),
+            positive=positive,
+            negative=build_negative_conditioning(generator.text_encoder),
+            latent_image=get_value_at_index(emptylatentimage.generate(width=512, height=512, batch_size=1), 0),
+        )
+        planned = plan.sample(positive, [item_seed])
 
-        # Initialize other nodes
-        cliptextencode = NODE_CLASS_MAPPINGS["CLIPTextEncode"]()
-        modelsamplingsd3 = NODE_CLASS_MAPPINGS["ModelSamplingSD3"]()
-        conditioningzeroout = NODE_CLASS_MAPPINGS["ConditioningZeroOut"]()
-        conditioningsettimesteprange = NODE_CLASS_MAPPINGS["ConditioningSetTimestepRange"]()
-        conditioningcombine = NODE_CLASS_MAPPINGS["ConditioningCombine"]()
-        ksampler = NODE_CLASS_MAPPINGS["KSampler"]()
-        vaedecode = NODE_CLASS_MAPPINGS["VAEDecode"]()
-        saveimage = NODE_CLASS_MAPPINGS["SaveImage"]()
-
-        # Generate images for each prompt
-        for idx, (key, data) in enumerate(prompts.items(), 1):
-            prompt = data.get('prompt', '').strip('"')  # Remove quotes if present
-            if not prompt:
-                continue
-                
-            print(f"Generating image {idx}/{len(prompts)}: {key}")
-            
-            # Create numbered filename and store mapping
-            filename = f"image_{idx:04d}"  # Creates filenames like image_0001, image_0002, etc.
-            filename_mapping[filename] = {
-                'key': key,
-                'prompt': prompt
-            }
-            
-            # Encode text
-            cliptextencode_positive = cliptextencode.encode(
-                text=prompt,
-                clip=get_value_at_index(triplecliploader, 0),
-            )
+        equal = torch.equal(get_value_at_index(reference, 0)['samples'], planned['samples'])
+        print(f"{key}: {'identical' if equal else 'DIFFERENT'}")
+        matched = matched and equal
+    return matched
 
-            cliptextencode_negative = cliptextencode.encode(
-                text="watermark",
-                clip=get_value_at_index(triplecliploader, 0),
-            )
 
-            # Rest of the pipeline
-            modelsamplingsd3_output = modelsamplingsd3.patch(
-                shift=3,
-                model=get_value_at_index(checkpointloadersimple, 0),
-            )
+def job_prompts(job):
+    """The {key: {'prompt': ...}} dict a queued job asks for."""
+    if 'prompts' in job:
+        return load_prompts(job['prompts'])
+    return {job.get('key', job['id']): {'prompt': job['prompt']}}
 
-            conditioningzeroout_output = conditioningzeroout.zero_out(
-                conditioning=get_value_at_index(cliptextencode_negative, 0),
-            )
 
-            conditioningsettimesteprange_1 = conditioningsettimesteprange.set_range(
-                start=0.1,
-                end=1,
-                conditioning=get_value_at_index(conditioningzeroout_output, 0),
-            )
+def serve(generator, jobs_dir, args):
+    """Resident worker: process jobs queued in `jobs_dir` with the already loaded models.
 
-            conditioningsettimesteprange_2 = conditioningsettimesteprange.set_range(
-                start=0,
-                end=1,
-                conditioning=get_value_at_index(cliptextencode_negative, 0),
-            )
+    Jobs are JSON files in jobs_dir/pending/ (see jobs.submit_job); each one is
+    moved to done/ or failed/ with its outcome. A failing job does not stop the
+    worker. Single-prompt jobs default to their own output directory, since image
+    filenames are numbered per prompt file.
+    """
+    requeued = requeue_orphans(jobs_dir)
+    if requeued:
+        print(f"Requeued {requeued} jobs of workers that stopped")
+    print(f"Models loaded, waiting for jobs in {jobs_dir}/pending")
+
+    while True:
+        claimed = claim_next(jobs_dir)
+        if claimed is None:
+            # idle workers also pick up the jobs of workers whose lease expired
+            requeue_orphans(jobs_dir)
+            time.sleep(args.poll)
+            continue
+
+        path, job = claimed
+        output_dir = job.get('output_dir') or str(Path(jobs_dir) / 'output' / job['id'])
+        print(f"Job {job['id']}: writing to {output_dir}")
+        start = time.perf_counter()
+        try:
+            with heartbeat(path):
+                generated = generator.run(
+                    job_prompts(job),
+                    output_dir,
+                    seed=job.get('seed', args.seed),
+                    batch_size=job.get('batch_size', args.batch_size),
+                    pipeline=args.pipeline,
+                    save_workers=args.save_workers,
+                )
+        except Exception as e:
+            print(f"Job {job['id']} failed: {e!r}")
+            finish_job(jobs_dir, path, job, error=repr(e), output_dir=output_dir)
+            continue
+        finish_job(jobs_dir, path, job, output_dir=output_dir, generated=generated,
+                   seconds=time.perf_counter() - start)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Generate one SD3.5 image per prompt in output.json.")
+    parser.add_argument('--prompts', default='output.json', help="prompt JSON ({key: {'prompt': ...}})")
+    parser.add_argument('--output-dir', default='generated_images')
+    parser.add_argument('--cache-dir', default='conditioning_cache',
+                        help="on-disk text conditioning cache, keyed by text and text encoder hash")
+    parser.add_argument('--no-cache', action='store_true', help="always run the text encoders")
+    parser.add_argument('--batch-size', type=int, default=1,
+                        help="prompts sampled together in one KSampler call (bucketed by conditioning length)")
+    parser.add_argument('--two-phase', action='store_true',
+                        help="encode every prompt into the cache, unload the text encoders, then sample")
+    parser.add_argument('--shard', type=parse_shard, default=(0, 1), metavar='I/N',
+                        help="only generate prompts whose number is I modulo N (0-based)")
+    parser.add_argument('--seed', type=int, default=0, help="base seed; each key gets a seed derived from it")
+    parser.add_argument('--pipeline', action='store_true',
+                        help="save images in background threads while the next group samples")
+    parser.add_argument('--save-workers', type=int, default=4, help="threads writing PNGs with --pipeline")
+    parser.add_argument('--latents-only', action='store_true',
+                        help="store sampled latents in safetensors shards instead of decoding and saving images")
+    parser.add_argument('--shard-size', type=int, default=256, help="latents per shard file with --latents-only")
+    parser.add_argument('--decode-latents', action='store_true',
+                        help="decode latents stored in --output-dir by a --latents-only run and exit")
+    parser.add_argument('--keys', help="file with one key per line to decode with --decode-latents (default: all)")
+    parser.add_argument('--decode-batch-size', type=int, default=16, help="latents per VAE call with --decode-latents")
+    parser.add_argument('--verify-plan', type=int, nargs='?', const=2, metavar='N',
+                        help="check on the first N prompts (default 2) that the job plan matches the "
+                             "per-prompt graph bit for bit, then exit")
+    parser.add_argument('--serve', metavar='JOBS_DIR',
+                        help="stay resident with all models loaded and process jobs queued in JOBS_DIR")
+    parser.add_argument('--poll', type=float, default=1.0, help="seconds between job directory scans with --serve")
+    parser.add_argument('--submit', metavar='JOBS_DIR',
+                        help="queue --prompts (or --prompt) for a resident worker and exit")
+    parser.add_argument('--prompt', help="single prompt text for --submit instead of a prompt file")
+    args = parser.parse_args()
+    if args.two_phase and args.no_cache:
+        parser.error("--two-phase stores conditionings in the cache and cannot be combined with --no-cache")
+    if args.serve and args.two_phase:
+        parser.error("--serve keeps the text encoders loaded and cannot be combined with --two-phase")
+    return args
+
+
+def submit(args):
+    job = {'prompt': args.prompt} if args.prompt else {'prompts': os.path.abspath(args.prompts)}
+    if args.prompt is None:
+        job['output_dir'] = os.path.abspath(args.output_dir)
+    job.update(seed=args.seed, batch_size=args.batch_size)
+    path = submit_job(args.submit, job)
+    print(f"Queued {path}")
 
-            conditioningcombine_output = conditioningcombine.combine(
-                conditioning_1=get_value_at_index(conditioningsettimesteprange_1, 0),
-                conditioning_2=get_value_at_index(conditioningsettimesteprange_2, 0),
-            )
 
-            ksampler_output = ksampler.sample(
-                seed=random.randint(1, 2**64),
-                steps=30,
-                cfg=8,
-                sampler_name="euler",
-                scheduler="normal",
-                denoise=1,
-                model=get_value_at_index(modelsamplingsd3_output, 0),
-                positive=get_value_at_index(cliptextencode_positive, 0),
-                negative=get_value_at_index(conditioningcombine_output, 0),
-                latent_image=get_value_at_index(emptylatentimage, 0),
-            )
+def main():
+    args = parse_args()
+    if args.submit:
+        # Queueing loads no models and does not even import ComfyUI
+        submit(args)
+        return
 
-            vaedecode_output = vaedecode.decode(
-                samples=get_value_at_index(ksampler_output, 0),
-                vae=get_value_at_index(checkpointloadersimple, 2),
-            )
+    setup_comfyui()
 
-            # Save image with numbered filename
-            saveimage.save_images(
-                filename_prefix=str(Path(output_dir) / filename),
-                images=get_value_at_index(vaedecode_output, 0),
-            )
-            
-        # Save the filename mapping
-        save_filename_mapping(filename_mapping, output_dir)
+    with torch.inference_mode():
+        if args.decode_latents:
+            # Decoding needs neither the text encoders nor their cache
+            keys = None
+            if args.keys:
+                with open(args.keys, 'r', encoding='utf-8') as f:
+                    keys = [line.strip() for line in f if line.strip()]
+            Generator().decode_stored(args.output_dir, keys, batch_size=args.decode_batch_size,
+                                      pipeline=args.pipeline, save_workers=args.save_workers)
+            return
+
+        cache = None
+        if not args.no_cache:
+            cache = ConditioningCache(args.cache_dir, encoder_fingerprint(text_encoder_paths(), args.cache_dir))
+        generator = Generator(cache)
+
+        if args.verify_plan:
+            if not verify_plan(generator, load_prompts(args.prompts), args.verify_plan, args.seed):
+                sys.exit(1)
+            return
+
+        if args.serve:
+            generator.load()
+            serve(generator, args.serve, args)
+            return
+
+        generator.run(
+            load_prompts(args.prompts),
+            args.output_dir,
+            shard=args.shard,
+            seed=args.seed,
+            batch_size=args.batch_size,
+            two_phase=args.two_phase,
+            pipeline=args.pipeline,
+            save_workers=args.save_workers,
+            latents_only=args.latents_only,
+            shard_size=args.shard_size,
+        )
 
 
 if __name__ == "__main__":
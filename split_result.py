@@ -3,34 +3,37 @@ import os
 from collections import defaultdict
 from pathlib import Path
 
+# Mapping for identity names in filenames
+IDENTITY_FILENAME_MAP = {
+    "age_18_to_21": "18_21",
+    "age_22_to_25": "22_25",
+    "age_26_to_29": "26_29",
+    "age_30_to_34": "30_34",
+    "age_35_to_40": "35_40",
+    "JuniorCollege": "JuniorCollege",
+    "JuniorHigh": "JuniorHigh",
+    "SeniorHigh": "SeniorHigh",
+    "TechnicalSecondarySchool": "TechnicalSecondary",
+    "University": "University",
+    "female": "female",
+    "male": "male",
+    "id_free": "no_id"
+}
+
+# Mapping for aspect names in filenames
+ASPECT_FILENAME_MAP = {
+    "quality": "perception",
+    "aesthetic": "aesthetic",
+    "emotion": "empathy"
+}
+
 class ResultSplitter:
     def __init__(self, results_file, output_dir):
         self.results_file = results_file
         self.output_dir = output_dir
         
-        # Mapping for identity names in filenames
-        self.identity_filename_map = {
-            "age_18_to_21": "18_21",
-            "age_22_to_25": "22_25",
-            "age_26_to_29": "26_29",
-            "age_30_to_34": "30_34",
-            "age_35_to_40": "35_40",
-            "JuniorCollege": "JuniorCollege",
-            "JuniorHigh": "JuniorHigh",
-            "SeniorHigh": "SeniorHigh",
-            "TechnicalSecondarySchool": "TechnicalSecondary",
-            "University": "University",
-            "female": "female",
-            "male": "male",
-            "id_free": "no_id"
-        }
-        
-        # Mapping for aspect names in filenames
-        self.aspect_filename_map = {
-            "quality": "perception",
-            "aesthetic": "aesthetic",
-            "emotion": "empathy"
-        }
+        self.identity_filename_map = IDENTITY_FILENAME_MAP
+        self.aspect_filename_map = ASPECT_FILENAME_MAP
 
     def load_results(self):
         with open(self.results_file, 'r') as f:
@@ -0,0 +1,70 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+# bias_stats reads the Parquet label store
+pytest.importorskip("pyarrow")
+
+from bias_stats import agreement_stats, js_divergence
+
+
+def cohen_kappa_loop(a, b):
+    """Cohen's kappa of two raters over the images both labelled (-1 = no label)."""
+    pairs = [(x, y) for x, y in zip(a, b) if x >= 0 and y >= 0]
+    labels = {label for pair in pairs for label in pair}
+    observed = sum(x == y for x, y in pairs) / len(pairs)
+    expected = sum(sum(x == label for x, _ in pairs) * sum(y == label for _, y in pairs)
+                   for label in labels) / len(pairs) ** 2
+    return (observed - expected) / (1 - expected)
+
+
+def codes_from_table(table):
+    """Two-rater codes with table[i][j] images labelled i by the first rater and j by the second."""
+    return np.array([(i, j) for i, row in enumerate(table) for j, count in enumerate(row) for _ in range(count)])
+
+
+def test_cohen_kappa_of_a_contingency_table():
+    # 20 yes/yes, 5 yes/no, 10 no/yes, 15 no/no: p_o = 0.7, p_e = 0.5
+    point, _ = agreement_stats(codes_from_table([[20, 5], [10, 15]]), 2)
+    assert point["cohen_kappa"][0, 1] == pytest.approx(0.4, abs=1e-6)
+    assert point["cohen_kappa"][1, 0] == pytest.approx(0.4, abs=1e-6)
+
+
+def test_cohen_kappa_uses_pairwise_complete_images():
+    codes = np.array([[0, 0, 1], [1, 1, -1], [0, 1, 0], [2, 2, 2], [1, -1, 1], [2, 2, 0], [0, 0, 0], [-1, 1, 2]])
+    point, _ = agreement_stats(codes, 3)
+    for i in range(3):
+        for j in range(3):
+            if i != j:
+                assert point["cohen_kappa"][i, j] == pytest.approx(cohen_kappa_loop(codes[:, i], codes[:, j]),
+                                                                   abs=1e-5)
+
+
+def test_fleiss_kappa_of_a_rating_table():
+    # Fleiss (1971) style example: 10 images, 14 raters, 5 labels; kappa = 0.210
+    table = [[0, 0, 0, 0, 14], [0, 2, 6, 4, 2], [0, 0, 3, 5, 6], [0, 3, 9, 2, 0], [2, 2, 8, 1, 1],
+             [7, 7, 0, 0, 0], [3, 2, 6, 3, 0], [2, 5, 3, 2, 2], [6, 5, 2, 1, 0], [0, 2, 2, 3, 7]]
+    codes = np.array([[label for label, count in enumerate(row) for _ in range(count)] for row in table])
+    point, _ = agreement_stats(codes, 5)
+    assert point["fleiss_kappa"] == pytest.approx(0.2099, abs=1e-4)
+
+
+def test_bootstrap_matches_a_loop_over_resampled_images():
+    rng = np.random.default_rng(1)
+    codes = rng.integers(-1, 3, size=(40, 2))
+    resamples, confidence, seed = 200, 0.9, 7
+    _, intervals = agreement_stats(codes, 3, resamples=resamples, confidence=confidence, seed=seed)
+
+    # the same multinomial draws, expanded back into resampled images and evaluated one at a time
+    patterns, counts = np.unique(codes, axis=0, return_counts=True)
+    weights = np.random.default_rng(seed).multinomial(len(codes), counts / len(codes), size=resamples)
+    kappas = [cohen_kappa_loop(*np.repeat(patterns, w, axis=0).T) for w in weights]
+    lower, upper = np.quantile(kappas, [0.05, 0.95])
+
+    assert intervals["cohen_kappa"][0][0, 1] == pytest.approx(lower, abs=1e-5)
+    assert intervals["cohen_kappa"][1][0, 1] == pytest.approx(upper, abs=1e-5)
+
+
+def test_js_divergence_bounds():
+    p = np.array([0.5, 0.5, 0.0])
+    assert js_divergence(p, p) == pytest.approx(0.0)
+    assert js_divergence(np.array([1.0, 0.0]), np.array([0.0, 1.0])) == pytest.approx(1.0)
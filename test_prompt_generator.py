@@ -0,0 +1,34 @@
+import pytest
+
+# prompt_generator imports the LLM client stack
+pytest.importorskip("aiohttp")
+pytest.importorskip("requests")
+
+from prompt_generator import clean_prompt, prompt_complete
+
+TAGGED = "<prompt>\n\nA close-up photo of a cracked phone screen on a wet street.\n\n</prompt>\nThis prompt shows"
+PREAMBLE = "Here is a prompt for the rule:\n\n**Prompt:** \"A crowded market at dusk, lanterns glowing.\"\n\nIt uses"
+
+
+def stream_stop(answer):
+    """The streamed prefix at which prompt_complete first stops, fed token by token."""
+    for end in range(1, len(answer) + 1):
+        if prompt_complete(answer[:end]):
+            return answer[:end]
+    return answer
+
+
+@pytest.mark.parametrize("answer, prompt", [
+    (TAGGED, "A close-up photo of a cracked phone screen on a wet street."),
+    (PREAMBLE, "A crowded market at dusk, lanterns glowing."),
+])
+def test_streaming_stops_after_the_whole_prompt(answer, prompt):
+    assert clean_prompt(stream_stop(answer)) == prompt
+    assert clean_prompt(answer) == prompt
+
+
+def test_partial_answers_are_not_complete():
+    assert not prompt_complete("<prompt>\n\nA ")
+    assert not prompt_complete("Here is a prompt for the rule:\n\n")
+    assert not prompt_complete("A close-up photo of")
+    assert prompt_complete("<prompt>A dog on a sofa.</prompt>")
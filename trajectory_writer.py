@@ -0,0 +1,140 @@
+import math
+import warnings
+from pathlib import Path
+
+import numpy as np
+
+
+VIDEO_SUFFIXES = ('.mp4', '.webm', '.mkv', '.avi', '.mov')
+
+
+# (B, C, H, W) in [-1, 1] -> one (rows*H, cols*W, 3) uint8 grid frame, without Python loops over images
+def to_grid_frame(batch, nrow=None, padding=2):
+    batch = np.asarray(batch, dtype=np.float32)
+    b, c, h, w = batch.shape
+    nrow = nrow or math.ceil(math.sqrt(b))
+    rows = math.ceil(b / nrow)
+
+    frame = ((batch + 1) * 127.5).clip(0, 255).astype(np.uint8)
+    if c == 1:
+        frame = np.repeat(frame, 3, axis=1)
+    frame = frame[:, :3]
+
+    # pad every cell, fill the incomplete last row, then tile with a single transpose
+    frame = np.pad(frame, ((0, nrow * rows - b), (0, 0), (padding, 0), (padding, 0)))
+    hp, wp = h + padding, w + padding
+    frame = frame.reshape(rows, nrow, 3, hp, wp).transpose(0, 3, 1, 4, 2).reshape(rows * hp, nrow * wp, 3)
+    frame = np.pad(frame, ((0, padding), (0, padding), (0, 0)))
+
+    # video encoders want even dimensions
+    return np.pad(frame, ((0, frame.shape[0] % 2), (0, frame.shape[1] % 2), (0, 0)))
+
+
+class TrajectoryWriter:
+    """Streams a sampling trajectory to a GIF or video, one denoising step at a time.
+
+    Only every `stride`-th step (plus the final one) is converted and encoded, so the
+    full trajectory is never held in memory. `transform` (e.g. latent decoding) is
+    applied to the kept steps only. Streaming needs imageio-ffmpeg; without it GIF
+    frames are buffered for Pillow (with a RuntimeWarning) and videos cannot be written.
+    """
+
+    def __init__(self, path, stride=1, nrow=None, fps=20, hold_last=20, transform=None, padding=2):
+        self.path = Path(path)
+        self.stride = stride
+        self.nrow = nrow
+        self.fps = fps
+        self.hold_last = hold_last
+        self.transform = transform
+        self.padding = padding
+
+        self.steps_seen = 0
+        self.frames_written = 0
+        self.last_step = None
+        self.last_frame = None
+        self.encoder = None
+        self.buffered = []
+
+    def frame(self, step):
+        if hasattr(step, 'detach'):
+            step = step.detach().cpu().numpy()
+        if self.transform is not None:
+            step = self.transform(step)
+        return to_grid_frame(step, nrow=self.nrow, padding=self.padding)
+
+    def open(self, frame):
+        height, width = frame.shape[:2]
+        try:
+            import imageio_ffmpeg
+        except ImportError:
+            # Pillow cannot append to an open GIF; fall back to buffering the (compact, uint8) frames
+            if self.path.suffix.lower() in VIDEO_SUFFIXES:
+                raise
+            warnings.warn(f"imageio-ffmpeg is not installed: every frame of {self.path} is kept in memory until "
+                          f"the GIF is written with Pillow (pip install imageio-ffmpeg to stream it)",
+                          RuntimeWarning, stacklevel=2)
+            self.encoder = 'pillow'
+            return
+
+        if self.path.suffix.lower() in VIDEO_SUFFIXES:
+            self.encoder = imageio_ffmpeg.write_frames(
+                str(self.path), (width, height), fps=self.fps, macro_block_size=1
+            )
+        else:
+            self.encoder = imageio_ffmpeg.write_frames(
+                str(self.path), (width, height), fps=self.fps, codec='gif', pix_fmt_out='pal8',
+                macro_block_size=1,
+                output_params=['-filter_complex', 'split[a][b];[a]palettegen[p];[b][p]paletteuse', '-loop', '0'],
+            )
+        self.encoder.send(None)
+
+    def write(self, frame):
+        if self.encoder is None:
+            self.open(frame)
+        if self.encoder == 'pillow':
+            self.buffered.append(frame)
+        else:
+            self.encoder.send(np.ascontiguousarray(frame))
+        self.frames_written += 1
+
+    def append(self, step):
+        if self.steps_seen % self.stride == 0:
+            self.last_frame = self.frame(step)
+            self.write(self.last_frame)
+            self.last_step = None
+        else:
+            # remembered so the final denoised step always ends the animation
+            self.last_step = step
+        self.steps_seen += 1
+
+    def close(self):
+        if self.last_step is not None:
+            self.last_frame = self.frame(self.last_step)
+            self.write(self.last_frame)
+            self.last_step = None
+        if self.last_frame is not None:
+            for _ in range(self.hold_last):
+                self.write(self.last_frame)
+
+        if self.encoder == 'pillow':
+            from PIL import Image
+            images = [Image.fromarray(frame) for frame in self.buffered]
+            images[0].save(self.path, save_all=True, append_images=images[1:], duration=int(1000 / self.fps), loop=0)
+            self.buffered = []
+        elif self.encoder is not None:
+            self.encoder.close()
+        self.encoder = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def write_trajectory(steps, path, **kwargs):
+    """Consume an iterable of (B, C, H, W) sampling steps and stream them to `path`."""
+    with TrajectoryWriter(path, **kwargs) as writer:
+        for step in steps:
+            writer.append(step)
+    return writer.frames_written